@@ -1,5 +1,6 @@
 import streamlit as st
-import traci
+import os
+import sys
 import time
 import folium
 from streamlit_folium import folium_static
@@ -9,6 +10,11 @@ import pandas as pd
 import logging
 import traceback
 
+# TraCI or libsumo through the backend adapter of the traffic signal project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                "Traffic-Signal-Optimization-using-Q-Learning-and-SUMO", "SUMO"))
+import sumo_backend as traci
+
 SUMO_BINARY = "sumo-gui"
 SUMO_CONFIG = "random.sumocfg"
 logging.basicConfig(filename='parking_system.log', level=logging.ERROR)
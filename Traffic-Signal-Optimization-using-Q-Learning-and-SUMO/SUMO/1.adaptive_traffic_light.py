@@ -1,4 +1,34 @@
-import traci
+import sumo_backend as traci
+
+# Demand tambahan yang dibangkitkan randomTrips langsung saat simulasi (None = nonaktif),
+# contoh: ["-n", "test.net.xml", "-e", "3600", "-p", "4", "--prefix", "online_", "--random-departpos"]
+ONLINE_DEMAND_ARGS = None
+INJECT_WINDOW = 60  # detik, trip untuk jendela waktu berikutnya ditambahkan sekaligus
+
+
+def inject_trips(trips, next_trip, until):
+    """Tambahkan semua trip yang berangkat sebelum `until` lewat TraCI, tanpa file XML.
+    Mengembalikan trip pertama yang belum ditambahkan (None jika habis).
+    Trip yang ditolak SUMO (keberangkatan sudah lewat, rute tidak valid) dilewati dengan peringatan,
+    sama seperti kendaraan yang tidak valid di file rute."""
+    while next_trip is not None and next_trip.depart < until:
+        attrs = next_trip.attributes
+        route_id = "route_" + next_trip.id
+        try:
+            # rute dengan asal dan tujuan saja dihitung ulang oleh SUMO seperti <trip>
+            traci.route.add(route_id, [next_trip.fromEdge, next_trip.toEdge])
+            traci.vehicle.add(next_trip.id, route_id, typeID=attrs.get("type", "DEFAULT_VEHTYPE"),
+                              depart=str(next_trip.depart), departLane=attrs.get("departLane", "first"),
+                              departPos=attrs.get("departPos", "base"), departSpeed=attrs.get("departSpeed", "0"),
+                              arrivalPos=attrs.get("arrivalPos", "max"))
+            if next_trip.via:
+                traci.vehicle.setVia(next_trip.id, next_trip.via)
+                traci.vehicle.rerouteTraveltime(next_trip.id)
+        except traci.TraCIException as e:
+            print(f"⚠️ Trip {next_trip.id} dilewati: {e}")
+        next_trip = next(trips, None)
+    return next_trip
+
 
 def run():
     # Jalankan SUMO GUI dengan output tripinfo_adaptive.xml saja
@@ -14,8 +44,18 @@ def run():
 
     print(f"✅ Ditemukan lampu lalu lintas: {tls_ids}")
 
+    trips = None
+    next_trip = None
+    if ONLINE_DEMAND_ARGS:
+        # randomTrips hanya dibutuhkan untuk demand online
+        import randomTrips
+        trips = randomTrips.iterTrips(randomTrips.get_options(ONLINE_DEMAND_ARGS))
+        next_trip = next(trips, None)
+
     step = 0
-    while traci.simulation.getMinExpectedNumber() > 0:
+    while traci.simulation.getMinExpectedNumber() > 0 or next_trip is not None:
+        if trips is not None and step % INJECT_WINDOW == 0:
+            next_trip = inject_trips(trips, next_trip, traci.simulation.getTime() + INJECT_WINDOW)
         traci.simulationStep()
         step += 1
 
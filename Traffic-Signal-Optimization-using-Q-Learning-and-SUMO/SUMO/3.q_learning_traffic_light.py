@@ -1,8 +1,16 @@
-import traci
+import sumo_backend as traci
+import traci.constants as tc
 import random
 import numpy as np
 import os
 import csv
+import copy
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ET
+from q_table import QTable, QUEUE_BINS, WAIT_BINS
 
 # Parameters
 ALPHA = 0.1
@@ -11,6 +19,12 @@ EPSILON = 0.1
 PHASES = [0, 2]  # assume 2 phases for simplicity
 PHASE_DURATION = 10
 
+# Training (--train): epsilon and alpha of episode e are max(MIN, start * DECAY ** e)
+EPSILON_DECAY = 0.95
+MIN_EPSILON = 0.01
+ALPHA_DECAY = 0.98
+MIN_ALPHA = 0.01
+
 LANE_NAMES = ["N", "S", "E", "W"]  # for logging
 
 def get_lane_ids(tls_id):
@@ -29,21 +43,29 @@ def get_lane_ids(tls_id):
             lane_map["W"].append(lane)
     return lane_map
 
+# Subscribe to the variables of get_state once after the start, SUMO then sends them
+# together with the answer to every simulation step
+def subscribe_state(tls_id, lane_map):
+    for lane in set([lane for lanes in lane_map.values() for lane in lanes]):
+        traci.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_NUMBER, tc.VAR_WAITING_TIME])
+    traci.trafficlight.subscribe(tls_id, [tc.TL_CURRENT_PHASE])
+
 # State definition: we simplify it as [vehicles in N/S lanes, vehicles in E/W lanes]
 def get_state(tls_id, lane_map):
+    lane_values = traci.lane.getAllSubscriptionResults()
     veh_counts = []
     waitings = []
     for d in LANE_NAMES:
         lanes = lane_map[d]
-        count = sum([traci.lane.getLastStepVehicleNumber(lane) for lane in lanes])
+        count = sum([lane_values[lane][tc.LAST_STEP_VEHICLE_NUMBER] for lane in lanes])
         veh_counts.append(min(count, 10))
         # Average waiting time per lane
         if lanes:
-            avg_wait = np.mean([traci.lane.getWaitingTime(lane) for lane in lanes])
+            avg_wait = np.mean([lane_values[lane][tc.VAR_WAITING_TIME] for lane in lanes])
         else:
             avg_wait = 0
         waitings.append(round(avg_wait, 1))
-    phase = traci.trafficlight.getPhase(tls_id)
+    phase = traci.trafficlight.getSubscriptionResults(tls_id)[tc.TL_CURRENT_PHASE]
     # State: (veh_N, veh_S, veh_E, veh_W, wait_N, wait_S, wait_E, wait_W, phase)
     return tuple(veh_counts + waitings + [phase])
 
@@ -58,64 +80,183 @@ def get_reward(prev_state, new_state):
     return reward
 
 # Choose action using epsilon-greedy policy
-def choose_action(state, q_table):
-    if random.uniform(0, 1) < EPSILON or state not in q_table:
-        return random.choice(PHASES)
-    return max(q_table[state], key=q_table[state].get)
+def choose_action(state, q_table, epsilon=EPSILON):
+    return q_table.choose_action(q_table.state_index(state), epsilon)
 
 # Update Q-value
-def update_q_table(q_table, state, action, reward, next_state):
-    if state not in q_table:
-        q_table[state] = {a: 0 for a in PHASES}
-    if next_state not in q_table:
-        q_table[next_state] = {a: 0 for a in PHASES}
-    old_q = q_table[state][action]
-    future_q = max(q_table[next_state].values())
-    q_table[state][action] = old_q + ALPHA * (reward + GAMMA * future_q - old_q)
+def update_q_table(q_table, state, action, reward, next_state, alpha=ALPHA):
+    q_table.update(q_table.state_index(state), action, reward, q_table.state_index(next_state), alpha, GAMMA)
 
-# Run simulation
+def count_phases(tls_id):
+    return max([len(logic.phases) for logic in traci.trafficlight.getAllProgramLogics(tls_id)])
 
-def run():
-    q_table = {}
-    sumo_cmd = ["sumo-gui", "-c", "map.sumocfg", "--tripinfo-output", "tripinfo_qlearning.xml"]
-    traci.start(sumo_cmd)
+def new_q_table(tls_id):
+    return QTable(PHASES, count_phases(tls_id), len(LANE_NAMES), QUEUE_BINS, WAIT_BINS)
 
-    tls_id = traci.trafficlight.getIDList()[0]
-    lane_map = get_lane_ids(tls_id)
-    print(f"Controlling traffic light: {tls_id}")
+def print_q_table_stats(q_table):
+    stats = q_table.stats()
+    print(f"Q-table: {stats['visited']} of {stats['states']} states visited ({stats['occupancy']:.2%}), "
+          f"{stats['updates']} updates, max {stats['max_updates']} per state, {stats['bytes'] / 1e6:.1f} MB")
 
+# Control the traffic light until the simulation ends, returns the total reward of the episode.
+# The updates are appended to transitions as (state index, action, reward, next state index) if given
+def run_episode(tls_id, lane_map, q_table, epsilon=EPSILON, alpha=ALPHA, writer=None, transitions=None):
     step = 0
+    total_reward = 0
     prev_state = get_state(tls_id, lane_map)
     current_phase = PHASES[0]
     traci.trafficlight.setPhase(tls_id, current_phase)
     phase_timer = 0
 
-    # Logging for analysis
-    log_path = "traffic_signal_data.csv"
-    with open(log_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["step"] + [f"veh_{d}" for d in LANE_NAMES] + [f"wait_{d}" for d in LANE_NAMES] + ["phase"])
-
-        while traci.simulation.getMinExpectedNumber() > 0:
-            traci.simulationStep()
-            step += 1
-            phase_timer += 1
+    while traci.simulation.getMinExpectedNumber() > 0:
+        traci.simulationStep()
+        step += 1
+        phase_timer += 1
 
+        decide = phase_timer >= PHASE_DURATION
+        if writer is not None or decide:
             state = get_state(tls_id, lane_map)
+        if writer is not None:
             # Log data
             writer.writerow([step] + list(state[:-1]) + [state[-1]])
 
-            if phase_timer >= PHASE_DURATION:
-                new_state = get_state(tls_id, lane_map)
-                reward = get_reward(prev_state, new_state)
-                action = choose_action(prev_state, q_table)
-                traci.trafficlight.setPhase(tls_id, action)
-                update_q_table(q_table, prev_state, action, reward, new_state)
-                prev_state = new_state
-                phase_timer = 0
+        if decide:
+            new_state = state
+            reward = get_reward(prev_state, new_state)
+            total_reward += reward
+            action = choose_action(prev_state, q_table, epsilon)
+            traci.trafficlight.setPhase(tls_id, action)
+            update_q_table(q_table, prev_state, action, reward, new_state, alpha)
+            if transitions is not None:
+                transitions.append((q_table.state_index(prev_state), action, reward, q_table.state_index(new_state)))
+            prev_state = new_state
+            phase_timer = 0
+    return total_reward
+
+# Mean waiting time of the vehicles in a tripinfo file
+def mean_waiting_time(tripinfo_file):
+    waitings = [float(trip.get("waitingTime")) for trip in ET.parse(tripinfo_file).getroot().findall("tripinfo")]
+    return sum(waitings) / len(waitings) if waitings else 0
+
+# Run simulation
+
+def run(q_table_file=None, gui=True):
+    sumo_cmd = ["sumo-gui" if gui else "sumo", "-c", "map.sumocfg", "--tripinfo-output", "tripinfo_qlearning.xml"]
+    traci.start(sumo_cmd)
+
+    tls_id = traci.trafficlight.getIDList()[0]
+    lane_map = get_lane_ids(tls_id)
+    subscribe_state(tls_id, lane_map)
+    print(f"Controlling traffic light: {tls_id}")
+    # continue with the table of a previous training (--train) if given
+    q_table = QTable.load(q_table_file) if q_table_file else new_q_table(tls_id)
+
+    # Logging for analysis
+    log_path = "traffic_signal_data.csv"
+    with open(log_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["step"] + [f"veh_{d}" for d in LANE_NAMES] + [f"wait_{d}" for d in LANE_NAMES] + ["phase"])
+        run_episode(tls_id, lane_map, q_table, writer=writer)
 
     traci.close()
+    print_q_table_stats(q_table)
     print("✅ Simulasi Q-Learning selesai. Data saved to traffic_signal_data.csv")
 
+# One headless training episode on a copy of the Q-table, the caller merges the returned transitions.
+# task: (q_table or None for a new table, epsilon, alpha, seed, label)
+def rollout(task):
+    q_table, epsilon, alpha, seed, label = task
+    random.seed(seed)
+    # the tripinfo output is only needed for the mean waiting time of this episode
+    tmp_dir = tempfile.mkdtemp(prefix="tripinfo_train_")
+    tripinfo_file = os.path.join(tmp_dir, f"{label}.xml")
+    sumo_cmd = ["sumo", "-c", "map.sumocfg", "--tripinfo-output", tripinfo_file,
+                "--seed", str(seed), "--no-step-log", "--no-warnings"]
+    # with TraCI every worker process gets its own connection on a free port
+    traci.start(sumo_cmd, label=label)
+    transitions = []
+    try:
+        tls_id = traci.trafficlight.getIDList()[0]
+        q_table = copy.deepcopy(q_table) if q_table is not None else new_q_table(tls_id)
+        lane_map = get_lane_ids(tls_id)
+        subscribe_state(tls_id, lane_map)
+        reward = run_episode(tls_id, lane_map, q_table, epsilon, alpha, transitions=transitions)
+    finally:
+        traci.close()
+    try:
+        mean_wait = mean_waiting_time(tripinfo_file)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return q_table.n_phases, reward, mean_wait, transitions
+
+# Headless training over several episodes, the Q-table is kept between the episodes.
+# With workers > 1 the episodes run in rounds of concurrent SUMO instances which all start from the
+# same table, their transitions are replayed into the shared table in episode order after each round
+def train(episodes, checkpoint, checkpoint_every=1, resume=False, seed=42, backend="auto", workers=1,
+          log_path="training_log.csv"):
+    if checkpoint_every < 1:
+        raise ValueError("checkpoint_every must be at least 1")
+    traci.set_backend(backend)
+    print(f"Training {episodes} episodes with {traci.select(['sumo']).__name__} in {workers} process(es)")
+    q_table = QTable.load(checkpoint) if resume and os.path.isfile(checkpoint) else None
+    if q_table is not None:
+        print(f"Resuming after episode {q_table.episodes} from {checkpoint}")
+    pool = multiprocessing.Pool(workers, traci.set_backend, (backend,)) if workers > 1 else None
+    try:
+        with open(log_path, "a" if q_table is not None else "w", newline="") as f:
+            log = csv.writer(f)
+            if q_table is None:
+                log.writerow(["episode", "epsilon", "alpha", "reward", "mean_waiting_time", "visited_states"])
+            done = 0
+            while done < episodes:
+                first = q_table.episodes if q_table is not None else 0
+                tasks = []
+                for episode in range(first, first + min(workers, episodes - done)):
+                    epsilon = max(MIN_EPSILON, EPSILON * EPSILON_DECAY ** episode)
+                    alpha = max(MIN_ALPHA, ALPHA * ALPHA_DECAY ** episode)
+                    tasks.append((q_table, epsilon, alpha, seed + episode, f"worker{len(tasks)}"))
+                results = pool.map(rollout, tasks) if pool is not None else map(rollout, tasks)
+                for (_, epsilon, alpha, _, _), (n_phases, reward, mean_wait, transitions) in zip(tasks, results):
+                    if q_table is None:
+                        q_table = QTable(PHASES, n_phases, len(LANE_NAMES), QUEUE_BINS, WAIT_BINS)
+                    q_table.replay(transitions, alpha, GAMMA)
+                    q_table.episodes += 1
+                    done += 1
+                    visited = q_table.stats()["visited"]
+                    log.writerow([q_table.episodes, epsilon, alpha, reward, mean_wait, visited])
+                    print(f"Episode {q_table.episodes}: epsilon {epsilon:.3f}, alpha {alpha:.3f}, "
+                          f"reward {reward:.1f}, mean waiting time {mean_wait:.2f} s, {visited} states visited")
+                    if q_table.episodes % checkpoint_every == 0:
+                        q_table.save(checkpoint)
+                f.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    q_table.save(checkpoint)
+    print_q_table_stats(q_table)
+    print(f"✅ Training selesai. Q-table saved to {checkpoint}, log saved to {log_path}")
+
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Q-learning traffic light control with SUMO")
+    parser.add_argument("--train", action="store_true", help="train headless over several episodes")
+    parser.add_argument("--episodes", type=int, default=50, help="number of training episodes")
+    parser.add_argument("--q-table", default="q_table.npz",
+                        help="checkpoint of the Q-table written by --train and used by the GUI run if it exists")
+    parser.add_argument("--checkpoint-every", type=int, default=5, help="write the checkpoint every INT episodes")
+    parser.add_argument("--resume", action="store_true", help="continue the training from the checkpoint")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the first episode, incremented per episode")
+    parser.add_argument("--backend", choices=traci.BACKENDS, default=os.environ.get("SUMO_BACKEND", "auto"),
+                        help="TraCI or in-process libsumo for runs without GUI, auto uses libsumo if installed")
+    parser.add_argument("--nogui", action="store_true", help="run the single simulation with sumo instead of sumo-gui")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of SUMO instances running training episodes at the same time")
+    args = parser.parse_args()
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+    if args.train:
+        train(args.episodes, args.q_table, args.checkpoint_every, args.resume, args.seed, args.backend,
+              max(1, args.workers))
+    else:
+        traci.set_backend(args.backend)
+        run(args.q_table if os.path.isfile(args.q_table) else None, not args.nogui)
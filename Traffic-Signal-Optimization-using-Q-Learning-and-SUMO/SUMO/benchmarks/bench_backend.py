@@ -0,0 +1,73 @@
+"""Simulation steps per second with the TraCI and the libsumo backend.
+
+Runs the scenario headless once per backend through sumo_backend and reads
+the observation of the Q-learning controller in every step (vehicle number
+and waiting time of each controlled lane and the phase of every traffic
+light), so the difference shows the socket round trips the controllers pay.
+With --subscriptions the observation is read from variable subscriptions as
+the Q-learning controller does.
+
+Usage: python benchmarks/bench_backend.py [-c map.sumocfg] [-s 3600] [--no-queries] [--subscriptions]
+"""
+import argparse
+import os
+import sys
+import time
+
+import traci.constants as tc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sumo_backend as traci  # noqa
+
+
+def bench(backend, args):
+    traci.set_backend(backend)
+    traci.start(["sumo", "-c", args.config, "--no-step-log", "--no-warnings"])
+    try:
+        tls_ids = traci.trafficlight.getIDList()
+        lanes = sorted(set([lane for tls_id in tls_ids for lane in traci.trafficlight.getControlledLanes(tls_id)]))
+        if args.subscriptions:
+            for lane in lanes:
+                traci.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_NUMBER, tc.VAR_WAITING_TIME])
+            for tls_id in tls_ids:
+                traci.trafficlight.subscribe(tls_id, [tc.TL_CURRENT_PHASE])
+        step = 0
+        calls = 0
+        start = time.time()
+        while step < args.steps and traci.simulation.getMinExpectedNumber() > 0:
+            traci.simulationStep()
+            step += 1
+            if args.subscriptions:
+                traci.lane.getAllSubscriptionResults()
+                traci.trafficlight.getAllSubscriptionResults()
+            elif not args.no_queries:
+                for lane in lanes:
+                    traci.lane.getLastStepVehicleNumber(lane)
+                    traci.lane.getWaitingTime(lane)
+                for tls_id in tls_ids:
+                    traci.trafficlight.getPhase(tls_id)
+                calls += 2 * len(lanes) + len(tls_ids)
+        duration = time.time() - start
+    finally:
+        traci.close()
+    print("%-8s %8s steps %8.3fs %10.1f steps/s %10s calls" % (backend, step, duration, step / duration, calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--config", default=os.path.join(os.path.dirname(__file__), "..", "map.sumocfg"),
+                        help="SUMO configuration of the scenario")
+    parser.add_argument("-s", "--steps", type=int, default=3600, help="maximum number of simulation steps")
+    parser.add_argument("--no-queries", action="store_true", help="only advance the simulation")
+    parser.add_argument("--subscriptions", action="store_true",
+                        help="read the observation from lane and traffic light subscriptions")
+    args = parser.parse_args()
+    bench("traci", args)
+    if traci.libsumo_available():
+        bench("libsumo", args)
+    else:
+        print("libsumo is not installed, skipping libsumo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Load time of randomTrips output as XML and with --columnar-output.
+
+Generates trips for the given network once, written as XML and as .npz (and
+as .parquet if pyarrow is installed), and compares reading the trips with
+sumolib's parse_fast to loading the columnar files.
+
+Usage: python benchmarks/bench_columnar.py [-n test.net.xml] [-p 0.01] [-e 3600] [-d OUTPUT_DIR]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import randomTrips  # noqa
+import sumolib  # noqa
+
+
+def bench(name, load, fname):
+    start = time.time()
+    n = load(fname)
+    duration = time.time() - start
+    print("%-24s %8.3fs %10s trips %8.1f MB" % (name, duration, n, os.path.getsize(fname) / 1e6))
+
+
+def load_xml(fname):
+    return len([t for t in sumolib.xml.parse_fast(fname, "trip", ["id", "depart", "from", "to"])])
+
+
+def load_npz(fname):
+    with np.load(fname) as columns:
+        data = dict([(key, columns[key]) for key in columns.files])
+    return len(data["id"])
+
+
+def load_parquet(fname):
+    import pyarrow.parquet as pq
+    return pq.read_table(fname).num_rows
+
+
+def run(args, directory):
+    xml = os.path.join(directory, "bench.trips.xml")
+    outputs = [("npz", os.path.join(directory, "bench.trips.npz"), load_npz)]
+    try:
+        import pyarrow  # noqa
+        outputs.append(("parquet", os.path.join(directory, "bench.trips.parquet"), load_parquet))
+    except ImportError:
+        print("pyarrow is not installed, skipping parquet")
+    for _, fname, _ in outputs:
+        randomTrips.main(randomTrips.get_options([
+            "-n", args.net_file, "-p", args.period, "-e", args.end, "--intermediate", "1",
+            "-o", xml, "--columnar-output", fname]))
+    bench("XML (parse_fast)", load_xml, xml)
+    for name, fname, load in outputs:
+        bench(name, load, fname)
+        os.remove(fname)
+    os.remove(xml)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--net-file", default=os.path.join(os.path.dirname(__file__), "..", "test.net.xml"),
+                        help="network to generate the trips for")
+    parser.add_argument("-p", "--period", default="0.01", help="insertion period of the generated trips")
+    parser.add_argument("-e", "--end", default="3600", help="end of the generated trips")
+    parser.add_argument("-d", "--directory", help="directory for the temporary output files")
+    args = parser.parse_args()
+    if args.directory:
+        run(args, args.directory)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run(args, directory)
+
+
+if __name__ == "__main__":
+    main()
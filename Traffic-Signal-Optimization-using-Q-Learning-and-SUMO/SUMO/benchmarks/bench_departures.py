@@ -0,0 +1,48 @@
+"""Speed of the randomTrips departure schedule for --random-depart and --binomial.
+
+Draws the departures of a whole day once with the sequential sampler (one
+Python level draw per departure or per second and Bernoulli trial, the
+behaviour of earlier randomTrips versions) and once with the vectorized
+sampler which draws the schedule of each interval with numpy.
+
+Usage: python benchmarks/bench_departures.py [-b 50] [-p 0.5] [-e 86400]
+"""
+import argparse
+import os
+import sys
+import time
+from argparse import Namespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import randomTrips  # noqa
+
+
+def bench(name, options, times):
+    start = time.time()
+    departures = [d for d, _, _ in randomTrips.iterDepartures(options, times)]
+    duration = time.time() - start
+    return name, duration, len(departures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-b", "--binomial", type=int, default=50, help="number of Bernoulli trials per second")
+    parser.add_argument("-p", "--period", type=float, default=0.5, help="insertion period")
+    parser.add_argument("-e", "--end", type=float, default=86400, help="end of the schedule")
+    parser.add_argument("-i", "--intervals", type=int, default=24, help="number of intervals")
+    args = parser.parse_args()
+    times = [args.end * i / args.intervals for i in range(args.intervals + 1)]
+    period = [args.period] * args.intervals
+    for mode, binomial, randomDepart in (("binomial %s" % args.binomial, args.binomial, False),
+                                         ("random-depart", None, True)):
+        results = []
+        for sampler in ("sequential", "vectorized"):
+            options = Namespace(period=period, binomial=binomial, randomDepart=randomDepart, depart_sampler=sampler)
+            results.append(bench("%s (%s)" % (mode, sampler), options, times))
+        for name, duration, count in results:
+            print("%-36s %8.3fs %10s departures" % (name, duration, count))
+        print("%-36s %8.1fx" % ("speedup", results[0][1] / results[1][1]))
+
+
+if __name__ == "__main__":
+    main()
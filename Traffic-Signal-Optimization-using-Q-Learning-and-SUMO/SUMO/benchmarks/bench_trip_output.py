@@ -0,0 +1,59 @@
+"""Throughput of the randomTrips trip output for plain and gzip files.
+
+Writes N synthetic <trip> elements once with one write call per trip through
+sumolib's openz (the behaviour of earlier randomTrips versions) and once
+through randomTrips.BufferedOutput with several compression settings.
+
+Usage: python benchmarks/bench_trip_output.py [-n 1000000] [-d OUTPUT_DIR]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import randomTrips  # noqa
+from sumolib.miscutils import openz  # noqa
+
+TRIP = '    <trip id="%s" depart="%.2f" from="%s" to="%s" departPos="%.2f"/>\n'
+
+
+def write_trips(out, n):
+    for i in range(n):
+        out.write(TRIP % (i, i * 0.1, "-131473132#%s" % (i % 7), "518974807#%s" % (i % 5), (i % 97) * 1.3))
+
+
+def bench(name, fname, opener, n):
+    start = time.time()
+    out = opener(fname)
+    write_trips(out, n)
+    out.close()
+    duration = time.time() - start
+    size = os.path.getsize(fname)
+    print("%-36s %8.2fs %10.0f trips/s %8.1f MB" % (name, duration, n / duration, size / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--trips", type=int, default=1000000, help="number of trips to write")
+    parser.add_argument("-d", "--directory", help="directory for the temporary output files")
+    args = parser.parse_args()
+    directory = args.directory or tempfile.mkdtemp()
+    plain = os.path.join(directory, "bench.trips.xml")
+    gz = plain + ".gz"
+    print("writing %s trips to %s" % (args.trips, directory))
+    bench("openz per trip (plain)", plain, lambda f: openz(f, "w"), args.trips)
+    bench("BufferedOutput (plain)", plain, randomTrips.BufferedOutput, args.trips)
+    bench("openz per trip (gzip 9)", gz, lambda f: openz(f, "w"), args.trips)
+    bench("BufferedOutput (gzip 9)", gz, randomTrips.BufferedOutput, args.trips)
+    bench("BufferedOutput (gzip 1)", gz, lambda f: randomTrips.BufferedOutput(f, compressLevel=1), args.trips)
+    for threads in (2, 4):
+        bench("BufferedOutput (gzip 9, %s threads)" % threads, gz,
+              lambda f: randomTrips.BufferedOutput(f, threads=threads), args.trips)
+    for fname in (plain, gz):
+        os.remove(fname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Array backed Q-table for the Q-learning traffic light controller.
+
+The raw state of 3.q_learning_traffic_light.py (vehicles per direction, average
+waiting time per direction, current phase) is discretized into bins and mapped
+to a dense integer index, so the Q-values of all states fit into one
+(states x actions) NumPy array with constant time lookup and update.
+"""
+from bisect import bisect_left
+import os
+import random
+
+import numpy as np
+
+# Upper bin edges: a value v falls into the first bin whose edge is >= v,
+# values above the last edge share one extra bin.
+QUEUE_BINS = (0, 3, 7)  # vehicles: 0 | 1-3 | 4-7 | >7
+WAIT_BINS = (0, 10, 30)  # seconds: 0 | 0-10 | 10-30 | >30
+
+
+class QTable:
+
+    """Q-values of the discretized states of one traffic light. The state
+    (veh_1..veh_n, wait_1..wait_n, phase) is mapped to a mixed radix index
+    with one digit per bin of each component"""
+
+    def __init__(self, actions, n_phases, n_lanes=4, queue_bins=QUEUE_BINS, wait_bins=WAIT_BINS):
+        self.actions = list(actions)
+        self.action_index = dict([(a, i) for i, a in enumerate(self.actions)])
+        self.n_lanes = n_lanes
+        self.n_phases = n_phases
+        self.queue_bins = list(queue_bins)
+        self.wait_bins = list(wait_bins)
+        self._bins = [self.queue_bins] * n_lanes + [self.wait_bins] * n_lanes
+        self._radices = [len(b) + 1 for b in self._bins] + [n_phases]
+        self.n_states = int(np.prod(self._radices))
+        self.values = np.zeros((self.n_states, len(self.actions)))
+        self.visits = np.zeros(self.n_states, dtype=np.int64)  # number of updates per state
+        self.episodes = 0  # number of finished training episodes
+
+    def state_index(self, state):
+        """return the index of the raw state tuple"""
+        if len(state) != 2 * self.n_lanes + 1:
+            raise ValueError("State %s does not have %s components." % (state, 2 * self.n_lanes + 1))
+        index = 0
+        for bins, value in zip(self._bins, state):
+            index = index * (len(bins) + 1) + bisect_left(bins, value)
+        phase = int(state[-1])
+        if not 0 <= phase < self.n_phases:
+            raise ValueError("Phase %s is not in the range of the %s phases." % (phase, self.n_phases))
+        return index * self.n_phases + phase
+
+    def choose_action(self, index, epsilon):
+        """epsilon-greedy action for the state index, random for unvisited states"""
+        if self.visits[index] == 0 or random.uniform(0, 1) < epsilon:
+            return random.choice(self.actions)
+        return self.actions[int(self.values[index].argmax())]
+
+    def update(self, index, action, reward, next_index, alpha, gamma):
+        row = self.values[index]
+        a = self.action_index[action]
+        row[a] += alpha * (reward + gamma * self.values[next_index].max() - row[a])
+        self.visits[index] += 1
+
+    def replay(self, transitions, alpha, gamma):
+        """apply the (index, action, reward, next index) transitions recorded on
+        another copy of the table, e.g. by a parallel rollout"""
+        for index, action, reward, next_index in transitions:
+            self.update(index, action, reward, next_index, alpha, gamma)
+
+    def stats(self):
+        """occupancy of the table: number of states with at least one update and
+        the distribution of the updates over them"""
+        visited = self.visits[self.visits > 0]
+        return {
+            "states": self.n_states,
+            "visited": len(visited),
+            "occupancy": len(visited) / self.n_states,
+            "updates": int(visited.sum()),
+            "mean_updates": float(visited.mean()) if len(visited) else 0.,
+            "max_updates": int(visited.max()) if len(visited) else 0,
+            "bytes": self.values.nbytes + self.visits.nbytes,
+        }
+
+    def save(self, fname):
+        """write the table as .npz, replacing fname only after it was written completely"""
+        tmp = fname + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, values=self.values, visits=self.visits, episodes=self.episodes,
+                     actions=self.actions, n_lanes=self.n_lanes, n_phases=self.n_phases,
+                     queue_bins=self.queue_bins, wait_bins=self.wait_bins)
+        os.replace(tmp, fname)
+
+    @staticmethod
+    def load(fname):
+        with np.load(fname) as data:
+            table = QTable(data["actions"].tolist(), int(data["n_phases"]), int(data["n_lanes"]),
+                           data["queue_bins"].tolist(), data["wait_bins"].tolist())
+            table.values[:] = data["values"]
+            table.visits[:] = data["visits"]
+            table.episodes = int(data["episodes"])
+        return table
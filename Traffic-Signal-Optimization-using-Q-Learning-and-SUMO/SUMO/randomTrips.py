@@ -22,18 +22,36 @@ from __future__ import print_function
 from __future__ import absolute_import
 import os
 import sys
+import re
 import random
 import bisect
+import heapq
+import copy
 import subprocess
-from collections import defaultdict
+import hashlib
+import json
+import shutil
+import tempfile
+import io
+import gzip
+import multiprocessing
+import cProfile
+import xml.etree.ElementTree as ET
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque, namedtuple
 import math
+from time import perf_counter
+
+import numpy as np
 
 if 'SUMO_HOME' in os.environ:
     sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
 import sumolib  # noqa
 from sumolib.miscutils import euclidean, parseTime, intIfPossible, openz  # noqa
 from sumolib.geomhelper import naviDegree, minAngleDegreeDiff  # noqa
-from sumolib.net.lane import is_vehicle_class  # noqa
+from sumolib.net.lane import is_vehicle_class, SUMO_VEHICLE_CLASSES  # noqa
 
 DUAROUTER = sumolib.checkBinary('duarouter')
 MAROUTER = sumolib.checkBinary('marouter')
@@ -44,6 +62,82 @@ VIA_SUFFIX = ".via.xml"
 
 MAXIMIZE_FACTOR = "max"
 
+# number of characters collected before the trip output is passed on
+OUTPUT_BLOCK_SIZE = 1 << 20
+
+# increase whenever the layout of the cached EdgeTable changes
+NET_CACHE_VERSION = 2
+
+# attribute="value" pairs of the generated trip attributes
+ATTRIBUTE_RE = re.compile(r'([\w.:-]+)="([^"]*)"')
+
+# a trip as yielded by iterTrips, via is a tuple of edge ids and attributes a dict
+TripRecord = namedtuple("TripRecord", ["id", "depart", "fromEdge", "toEdge", "via", "attributes"])
+
+# bits of EdgeTable.fringe, one per variant of sumolib's Edge.is_fringe
+FRINGE = 1  # is_fringe()
+FRINGE_INCOMING = 2  # is_fringe(edge._incoming)
+FRINGE_OUTGOING = 4  # is_fringe(edge._outgoing)
+FRINGE_JUNCTION = 8  # is_fringe(checkJunctions=True)
+FRINGE_INCOMING_JUNCTION = 16  # is_fringe(edge._incoming, checkJunctions=True)
+FRINGE_OUTGOING_JUNCTION = 32  # is_fringe(edge._outgoing, checkJunctions=True)
+
+
+class RunProfile:
+
+    """Wall time and number of calls per phase of a run plus event counts,
+    written as a JSON report by --profile"""
+
+    def __init__(self):
+        self.begin = perf_counter()
+        self.phases = {}  # name -> [seconds, calls]
+        self.counts = defaultdict(int)
+        self._cprofile = None
+
+    @contextmanager
+    def phase(self, name):
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - begin)
+
+    def add_time(self, name, seconds):
+        entry = self.phases.setdefault(name, [0., 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def merge_counts(self, counts):
+        for name, n in counts.items():
+            self.counts[name] += n
+
+    def start_cprofile(self):
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+
+    def write(self, options):
+        """write the report and the cProfile statistics requested by options"""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(options.profileStats)
+        if options.profile:
+            report = {
+                "command": sys.argv,
+                "net": options.netfile,
+                "total": perf_counter() - self.begin,
+                "phases": dict([(name, {"time": t, "calls": n}) for name, (t, n) in self.phases.items()]),
+                "counts": dict(self.counts),
+            }
+            with open(options.profile, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+# the profile of the current run (or of the current shard in a worker process)
+RUN_PROFILE = RunProfile()
+
 
 def get_options(args=None):
     op = sumolib.options.ArgumentParser(description="Generate trips between random locations",
@@ -58,6 +152,9 @@ def get_options(args=None):
                     "'prefix'.src.xml, 'prefix'.dst.xml and 'prefix'.via.xml")
     op.add_argument("--edge-type-file", category="input", dest="typeFactorFile",
                     help="Load a file that defines probability factors for specific edge types (each line with 'TYPE FLOAT')")  # noqa
+    op.add_argument("--net-cache", category="input", dest="netCache",
+                    help="keep a binary snapshot of the network attributes in the given directory and load it " +
+                    "instead of parsing the net file again as long as the net file is unchanged")
     # output
     op.add_argument("-o", "--output-trip-file", category="output", dest="tripfile", type=op.route_file,
                     default="trips.trips.xml",
@@ -70,6 +167,18 @@ def get_options(args=None):
                     help="generates weights files for visualisation")
     op.add_argument("--error-log", category="output", dest="errorlog", type=op.file,
                     help="record routing errors")
+    op.add_argument("--compression-level", category="output", dest="compressLevel", type=int,
+                    help="gzip compression level [1-9] for output files ending in .gz (default 9)")
+    op.add_argument("--compression-threads", category="output", dest="compressThreads", type=int, default=0,
+                    help="compress .gz output in INT parallel threads (as consecutive gzip members)")
+    op.add_argument("--profile", category="output", type=op.file,
+                    help="write a JSON report with the wall time per phase and the number of sampled trips, " +
+                    "written bytes, router calls and validation rounds to FILE")
+    op.add_argument("--profile-stats", category="output", dest="profileStats", type=op.file,
+                    help="write cProfile statistics of the run to FILE (readable with pstats)")
+    op.add_argument("--columnar-output", category="output", dest="columnarOutput", type=op.file,
+                    help="write the id, depart, from, to, via, type, departPos and arrivalPos of the final trips " +
+                    "as columns to FILE (.npz with numpy or .parquet with pyarrow)")
     # persons
     op.add_argument("--pedestrians", category="persons", action="store_true", default=False,
                     help="create a person file with pedestrian trips instead of vehicle trips")
@@ -121,6 +230,19 @@ def get_options(args=None):
                     help="weight edge probability by angle [0-360] relative to the network center")
     op.add_argument("--angle-factor", category="weights", dest="angle_weight", default=1.0, type=float,
                     help="maximum weight factor for angle")
+    op.add_argument("--fit-counts", category="weights", dest="fitCounts", type=op.additional_file,
+                    help="fit the source and sink weights (starting from the weights of --weights-prefix if given) " +
+                    "so that the generated trips match the edge counts in the given edgeData files")
+    op.add_argument("--fit-attributes", category="weights", dest="fitAttributes", default="departed,arrived",
+                    help="the edgeData attributes with the counts for the source and the sink weights, " +
+                    "leave one empty to keep these weights (default 'departed,arrived')")
+    op.add_argument("--fit-iterations", category="weights", dest="fitIterations", type=int, default=20,
+                    help="maximum number of fitting iterations (default 20)")
+    op.add_argument("--fit-tolerance", category="weights", dest="fitTolerance", type=float, default=0.05,
+                    help="stop fitting when the expected count of every counted edge deviates by at most FLOAT " +
+                    "relative to its count (default 0.05)")
+    op.add_argument("--fit-samples", category="weights", dest="fitSamples", type=int, default=100000,
+                    help="number of candidate trips drawn per fitting iteration (default 100000)")
     op.add_argument("--random-factor", category="weights", dest="randomFactor", default=1.0, type=float,
                     help="edge weights are dynamically disturbed by a random factor drawn uniformly from [1,FLOAT]")
     op.add_argument("--fringe-factor", category="weights", dest="fringe_factor", default="1.0",
@@ -148,19 +270,36 @@ def get_options(args=None):
                     help="random seed")
     op.add_argument("--random", action="store_true", default=False,
                     help="use a random seed to initialize the random number generator")
+    op.add_argument("--seed-streams", dest="seedStreams", action="store_true", default=False,
+                    help="draw the sources, sinks, via edges, departures and positions of each interval from " +
+                    "separate random streams derived from --seed so that changing one interval keeps the trips " +
+                    "of all others (trip ids become PREFIX<interval>.<index>)")
+    op.add_argument("--regenerate-interval", dest="regenerateInterval", type=int,
+                    help="replace the trips of interval INT in the existing trip file by newly generated ones " +
+                    "(implies --seed-streams), cannot be combined with --route-file and --columnar-output")
     op.add_argument("--min-distance", dest="min_distance", metavar="FLOAT", default=0.0,
                     type=float, help="require start and end edges for each trip to be at least 'FLOAT' m apart")
     op.add_argument("--min-distance.fringe", dest="min_dist_fringe", metavar="FLOAT", type=float,
                     help="require start and end edges for each fringe to fringe trip to be at least 'FLOAT' m apart")
     op.add_argument("--max-distance", dest="max_distance", metavar="FLOAT", type=float,
                     help="require start and end edges for each trip to be at most 'FLOAT' m " +
-                    "apart (default 0 which disables any checks)")
+                    "apart (default 0 which disables any checks); with --network-distance only the lower bound " +
+                    "of the network distance is checked, so longer trips may still be written")
     op.add_argument("-i", "--intermediate", default=0, type=int,
                     help="generates the given number of intermediate way points")
     op.add_argument("--jtrrouter", action="store_true", default=False,
                     help="Create flows without destination as input for jtrrouter")
     op.add_argument("--maxtries", default=100, type=int,
                     help="number of attemps for finding a trip which meets the distance constraints")
+    op.add_argument("--edge-sampler", dest="edge_sampler", default="bisect", choices=["bisect", "alias"],
+                    help="method for drawing weighted random edges: 'bisect' (default) reproduces the output of " +
+                    "earlier versions for a given seed, 'alias' draws in constant time using an alias table")
+    op.add_argument("-j", "--jobs", default=1, type=int,
+                    help="generate the trips in INT worker processes, each with a seed derived from --seed, " +
+                    "the output is reproducible for a given seed and number of jobs")
+    op.add_argument("--batch-size", dest="batch_size", default=0, type=int,
+                    help="draw and check INT candidate trips at once and serve trips from the accepted ones " +
+                    "(default 0 draws one candidate at a time)")
     op.add_argument("--remove-loops", dest="remove_loops", action="store_true", default=False,
                     help="Remove loops at route start and end")
     op.add_argument("--random-routing-factor", dest="randomRoutingFactor", default=1, type=float,
@@ -168,10 +307,28 @@ def get_options(args=None):
                     "by a random factor drawn uniformly from [1,FLOAT)")
     op.add_argument("--marouter", default=False, action="store_true",
                     help="Compute routes with marouter instead of duarouter")
+    op.add_argument("--routing-chunk-size", dest="routingChunkSize", default=0, type=int,
+                    help="route the trips for --route-file in chunks of INT consecutive departures, each chunk is " +
+                    "routed by duarouter while the later chunks are still generated")
+    op.add_argument("--routing-jobs", dest="routingJobs", default=1, type=int,
+                    help="number of duarouter processes for --routing-chunk-size which may run at the same time")
     op.add_argument("--validate", default=False, action="store_true",
                     help="Whether to produce trip output that is already checked for connectivity")
+    op.add_argument("--check-reachability", dest="checkReachability", action="store_true", default=False,
+                    help="reject trips which cannot be routed over the connections of the network for the " +
+                    "vehicle class of --edge-permission before writing them (stored with --net-cache)")
+    op.add_argument("--network-distance", dest="networkDistance", action="store_true", default=False,
+                    help="apply --min-distance, --min-distance.fringe and --max-distance to a lower bound of the " +
+                    "distance over the connections of the network (from landmark distances stored with " +
+                    "--net-cache) instead of the straight line distance, trips without a connection are rejected; " +
+                    "since the bound may underestimate the route length, --max-distance is only a necessary condition")
+    op.add_argument("--landmarks", default=16, type=int,
+                    help="number of landmark edges for --network-distance (default 16)")
     op.add_argument("--min-success-rate", dest="minSuccessRate", default=0.1, type=float,
                     help="Minimum ratio of valid trips to retry sampling if some trips are invalid")
+    op.add_argument("--validation-cache", dest="validationCache", type=op.file,
+                    help="validate incrementally: only origin-destination pairs of unknown validity are routed, " +
+                    "the results are kept in FILE for later runs on the same network (implies --validate)")
     op.add_argument("-v", "--verbose", action="store_true", default=False,
                     help="tell me what you are doing")
     # flow
@@ -191,6 +348,10 @@ def get_options(args=None):
                        action=sumolib.options.SplitAction,
                        help="How much vehicles arrive in the simulation per hour per kilometer of road " +
                        "(alternative to the period option).")
+    op.add_argument("--demand-profile", category="flow", dest="demandProfile", type=op.file,
+                    help="load the intervals of the demand from FILE, each with a rate (or period) and with factors " +
+                    "for the source (src), destination (dst) and via weights of edges or edge types " +
+                    "(alternative to the period option)")
     op.add_argument("--flows", category="flow", default=0, type=int,
                     help="generates INT flows that together output vehicles with the specified period")
     op.add_argument("--poisson", default=False, action="store_true",
@@ -200,8 +361,15 @@ def get_options(args=None):
     op.add_argument("--binomial",  category="flow", metavar="N", type=int,
                     help="If this is set, the number of departures per second will be drawn from a binomial " +
                     "distribution with n=N and p=PERIOD/N where PERIOD is the argument given to --period")
+    op.add_argument("--depart-sampler", category="flow", dest="depart_sampler", default="sequential",
+                    choices=["sequential", "vectorized"],
+                    help="method for drawing the departures of --random-depart and --binomial: 'sequential' " +
+                    "(default) reproduces the output of earlier versions for a given seed, 'vectorized' draws " +
+                    "the schedule of each interval at once")
 
     options = op.parse_args(args=args)
+    if options.profileStats:
+        RUN_PROFILE.start_cprofile()
     if options.edge_permission and not is_vehicle_class(options.edge_permission):
         raise ValueError("The string '%s' doesn't correspond to a legit vehicle class." % options.edge_permission)
 
@@ -213,19 +381,33 @@ def get_options(args=None):
             options.edge_permission = options.vehicle_class
         else:
             options.edge_permission = 'pedestrian' if options.pedestrians else 'passenger'
+    if options.validationCache:
+        options.validate = True
     if options.validate and options.routefile is None:
         options.routefile = "routes.rou.xml"
 
+    options.intervalTimes = None
+    options.intervalOverrides = None
+    if options.demandProfile:
+        if options.period or options.insertionRate or options.insertionDensity:
+            raise ValueError("Option --demand-profile cannot be combined with --period, --insertion-rate " +
+                             "or --insertion-density.")
+        options.intervalTimes, options.period, options.intervalOverrides = loadDemandProfile(options.demandProfile)
+        options.begin = options.intervalTimes[0]
+        options.end = options.intervalTimes[-1]
+
     if options.period is None and options.insertionRate is None and options.insertionDensity is None:
         options.period = [1.]
 
-    options.net = sumolib.net.readNet(options.netfile)
+    with RUN_PROFILE.phase("net load"):
+        options.net, options.edgeTable = loadEdgeTable(options.netfile, options.netCache, options.verbose)
     if options.insertionDensity:
         # Compute length of the network
         length = 0.  # In meters
-        for edge in options.net.getEdges():
-            if edge.allows(options.edge_permission):
-                length += edge.getLaneNumber() * edge.getLength()
+        edges = options.edgeTable
+        for i in range(len(edges)):
+            if edges.allows(i, options.edge_permission):
+                length += edges.lanes[i] * edges.length[i]
         if length == 0:
             raise ValueError("No valid edges for computing insertion-density")
 
@@ -244,6 +426,23 @@ def get_options(args=None):
                     print("Warning: Option --binomial %s is too low for insertion period %s." % (options.binomial, p)
                           + " Insertions will not be randomized.", file=sys.stderr)
 
+    if options.checkReachability and (options.pedestrians or options.junctionTaz or options.jtrrouter):
+        print("Warning: Option --check-reachability is ignored for pedestrians, --junction-taz and --jtrrouter.",
+              file=sys.stderr)
+        options.checkReachability = False
+    if options.networkDistance and options.pedestrians:
+        print("Warning: Option --network-distance is ignored for pedestrians.", file=sys.stderr)
+        options.networkDistance = False
+    if options.landmarks < 1:
+        raise ValueError("Option --landmarks must be positive.")
+
+    if options.routingChunkSize < 0 or options.routingJobs < 1:
+        raise ValueError("Option --routing-chunk-size must not be negative and --routing-jobs must be positive.")
+    if options.routingChunkSize and (options.validate or options.marouter or options.flows > 0):
+        print("Warning: Option --routing-chunk-size is ignored for --validate, --marouter and --flows.",
+              file=sys.stderr)
+        options.routingChunkSize = 0
+
     if options.jtrrouter and options.flows <= 0:
         raise ValueError("Option --jtrrouter must be used with option --flows.")
 
@@ -275,11 +474,68 @@ def get_options(args=None):
     if options.randomFactor < 1:
         raise ValueError("Option --random-factor requires a value >= 1.")
 
+    if options.batch_size < 0:
+        raise ValueError("Option --batch-size must be non-negative.")
+
+    if options.compressLevel is not None and not 0 <= options.compressLevel <= 9:
+        raise ValueError("Option --compression-level must be in the range [0, 9].")
+    if options.compressThreads < 0:
+        raise ValueError("Option --compression-threads must be non-negative.")
+
+    if options.jobs < 1:
+        raise ValueError("Option --jobs must be positive.")
+    if options.jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("Warning: Option --jobs requires the 'fork' start method which is not available on this platform. " +
+              "Using a single process.", file=sys.stderr)
+        options.jobs = 1
+
+    if options.regenerateInterval is not None:
+        if options.random:
+            raise ValueError("Option --regenerate-interval needs a fixed --seed.")
+        if not os.path.isfile(options.tripfile):
+            raise ValueError("Option --regenerate-interval needs the existing trip file '%s'." % options.tripfile)
+        if options.routefile or options.columnarOutput:
+            # both would only receive the regenerated interval and get out of step with the trip file
+            raise ValueError("Option --regenerate-interval cannot be combined with --route-file or --columnar-output.")
+        options.seedStreams = True
+    if options.seedStreams:
+        if options.flows > 0 or options.validate:
+            raise ValueError("Option --seed-streams cannot be combined with --flows or --validate.")
+        if options.jobs > 1:
+            print("Warning: Option --jobs is ignored for --seed-streams.", file=sys.stderr)
+            options.jobs = 1
+
+    if options.columnarOutput:
+        if options.flows > 0:
+            raise ValueError("Option --columnar-output cannot be combined with --flows.")
+        if options.columnarOutput.endswith(".parquet"):
+            try:
+                import pyarrow  # noqa
+            except ImportError:
+                raise ValueError("Option --columnar-output needs pyarrow for .parquet files, use .npz instead.")
+        elif not options.columnarOutput.endswith(".npz"):
+            raise ValueError("Option --columnar-output needs a file ending with .npz or .parquet.")
+
     if options.fromStops or options.toStops:
-        options.edgeFromStops, options.edgeToStops = loadStops(options)
+        with RUN_PROFILE.phase("stops"):
+            options.edgeFromStops, options.edgeToStops, options.fromStopCounts, options.toStopCounts = \
+                loadStops(options)
 
     if options.viaEdgeTypes:
         options.viaEdgeTypes = options.viaEdgeTypes.split(',')
+
+    if options.fitCounts:
+        if options.flows > 0:
+            raise ValueError("Option --fit-counts cannot be combined with --flows.")
+        if options.fitIterations < 1 or options.fitSamples < 1 or options.fitTolerance < 0:
+            raise ValueError("Options --fit-iterations and --fit-samples must be positive and " +
+                             "--fit-tolerance must not be negative.")
+        fitAttributes = options.fitAttributes.split(',')
+        if len(fitAttributes) == 1:
+            fitAttributes *= 2
+        if len(fitAttributes) != 2:
+            raise ValueError("Option --fit-attributes needs one or two attribute names.")
+        options.fitAttributes = [attr or None for attr in fitAttributes]
     if options.fringe_speed_exponent is None:
         options.fringe_speed_exponent = options.speed_exponent
 
@@ -307,7 +563,80 @@ class InvalidGenerator(Exception):
     pass
 
 
+def loadDemandProfile(fname):
+    """return the interval boundaries, the period and the weight overrides of each
+    interval of a demand profile. Gaps between the intervals get period 0.
+    The overrides of an interval are a sorted tuple of (selector, id, weights, factor)
+    with selector 'edge' or 'type' and weights one of 'src', 'dst' and 'via', e.g.
+    <profile>
+        <interval begin="0" end="3600" rate="800">
+            <weight edge="E1" src="5"/>
+            <weight type="highway.primary" dst="0.5" via="2"/>
+        </interval>
+    </profile>"""
+    intervals = []
+    for interval in sumolib.xml.parse(fname, "interval"):
+        begin = parseTime(interval.begin)
+        end = parseTime(interval.end)
+        if interval.rate is not None:
+            rate = float(interval.rate)
+            period = 3600.0 / rate if rate != 0.0 else 0.0
+        elif interval.period is not None:
+            period = float(interval.period)
+        else:
+            raise ValueError("Interval %s-%s of demand profile '%s' needs a rate or period." % (begin, end, fname))
+        overrides = []
+        for weight in (interval.weight if interval.hasChild("weight") else []):
+            if (weight.edge is None) == (weight.type is None):
+                raise ValueError("Weights of demand profile '%s' need either an edge or a type." % fname)
+            selector, selectorID = ("edge", weight.edge) if weight.edge is not None else ("type", weight.type)
+            for which in ("src", "dst", "via"):
+                factor = weight.getAttributeSecure(which)
+                if factor is not None:
+                    overrides.append((selector, selectorID, which, float(factor)))
+        intervals.append((begin, end, period, tuple(sorted(overrides))))
+    if not intervals:
+        raise ValueError("Demand profile '%s' contains no intervals." % fname)
+    intervals.sort()
+    times = [intervals[0][0]]
+    periods = []
+    profile = []
+    for begin, end, period, overrides in intervals:
+        if begin < times[-1] or end <= begin:
+            raise ValueError("Intervals of demand profile '%s' must not be empty or overlap." % fname)
+        if begin > times[-1]:
+            times.append(begin)
+            periods.append(0.)
+            profile.append(())
+        times.append(end)
+        periods.append(period)
+        profile.append(overrides)
+    return list(map(intIfPossible, times)), periods, profile
+
+
+def iterElements(fname, elementNames, attrs):
+    """yield (tag, value1, value2, ...) of the given attributes for the elements with
+    the given names in document order, streaming the file and discarding the parsed elements"""
+    with openz(fname, "rb") as f:
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if elem.tag in elementNames:
+                yield (elem.tag,) + tuple([elem.get(attr) for attr in attrs])
+                elem.clear()
+            if depth == 1:
+                root.clear()
+
+
 def loadStops(options):
+    """return the stops per edge id for --from-stops and --to-stops and the
+    number of stops per row of options.edgeTable"""
     edgeFromStops = defaultdict(list)  # edge -> [(stopType1, stopID1), ...]
     edgeToStops = defaultdict(list)  # edge -> [(stopType1, stopID1), ...]
     if options.additional is None:
@@ -325,16 +654,27 @@ def loadStops(options):
         stopTypes += options.toStops
     else:
         options.toStops = []
-    stopTypes = list(set(stopTypes))
+    stopTypes = set(stopTypes)
+    fromTypes = set(options.fromStops)
+    toTypes = set(options.toStops)
+    edges = options.edgeTable
+    laneEdges = edges.lane_index()
+    fromStopCounts = np.zeros(len(edges), dtype=np.float64)
+    toStopCounts = np.zeros(len(edges), dtype=np.float64)
     typeCounts = defaultdict(lambda: 0)
     for additional in options.additional.split(','):
-        for stop in sumolib.xml.parse(additional, stopTypes):
-            edgeID = stop.lane.rsplit('_', 1)[0]
-            if stop.name in options.fromStops:
-                edgeFromStops[edgeID].append((stop.name, stop.id))
-            if stop.name in options.toStops:
-                edgeToStops[edgeID].append((stop.name, stop.id))
-            typeCounts[stop.name] += 1
+        for stopType, stopID, laneID in iterElements(additional, stopTypes, ("id", "lane")):
+            index = laneEdges.get(laneID)
+            edgeID = laneID.rsplit('_', 1)[0] if index is None else edges.ids[index]
+            if stopType in fromTypes:
+                edgeFromStops[edgeID].append((stopType, stopID))
+                if index is not None:
+                    fromStopCounts[index] += 1
+            if stopType in toTypes:
+                edgeToStops[edgeID].append((stopType, stopID))
+                if index is not None:
+                    toStopCounts[index] += 1
+            typeCounts[stopType] += 1
 
     if options.fromStops:
         available = sum([typeCounts[t] for t in options.fromStops])
@@ -350,36 +690,629 @@ def loadStops(options):
                 ('' if len(options.toStops) == 1 else 's'),
                 options.toStops[0], options.additional), file=sys.stderr)
             sys.exit(1)
-    return edgeFromStops, edgeToStops
+    return edgeFromStops, edgeToStops, fromStopCounts, toStopCounts
+
+
+class EdgeTable:
+
+    """Column store of the edge attributes needed for trip generation.
+    Row i describes net._edges[i] so that the sampling code can work with
+    edge indices instead of sumolib Edge objects."""
+
+    def __init__(self):
+        self.ids = []
+        self.types = []
+        self.params = []
+        self.node_ids = []
+        self.vclasses = sorted(SUMO_VEHICLE_CLASSES)
+        self.boundary = (0., 0., 0., 0.)
+        self.bbox_diameter = 0.
+        self.from_node = self.to_node = None
+        self.from_x = self.from_y = self.to_x = self.to_y = None
+        self.center_x = self.center_y = None
+        self.length = self.speed = self.lanes = None
+        self.fringe = self.roundabout = self.permissions = None
+        # successors in compressed sparse row layout: the edges reachable over a
+        # connection from edge i are succ_edge[succ_ptr[i]:succ_ptr[i + 1]]
+        self.succ_ptr = self.succ_edge = self.succ_permissions = None
+
+    @classmethod
+    def fromNet(cls, net):
+        table = cls()
+        edges = net._edges
+        nodeIndex = dict([(n.getID(), i) for i, n in enumerate(net.getNodes())])
+        classIndex = dict([(c, i) for i, c in enumerate(table.vclasses)])
+        roundabouts = set()
+        for roundabout in net.getRoundabouts():
+            roundabouts.update(roundabout.getEdges())
+        table.ids = [e.getID() for e in edges]
+        table.types = [e.getType() for e in edges]
+        table.params = [dict(e.getParams()) for e in edges]
+        table.node_ids = [n.getID() for n in net.getNodes()]
+        table.boundary = tuple(net.getBoundary())
+        table.bbox_diameter = net.getBBoxDiameter()
+        table.from_node = np.array([nodeIndex[e.getFromNode().getID()] for e in edges], dtype=np.int32)
+        table.to_node = np.array([nodeIndex[e.getToNode().getID()] for e in edges], dtype=np.int32)
+        table.from_x = np.array([e.getFromNode().getCoord()[0] for e in edges], dtype=np.float64)
+        table.from_y = np.array([e.getFromNode().getCoord()[1] for e in edges], dtype=np.float64)
+        table.to_x = np.array([e.getToNode().getCoord()[0] for e in edges], dtype=np.float64)
+        table.to_y = np.array([e.getToNode().getCoord()[1] for e in edges], dtype=np.float64)
+        centers = []
+        for e in edges:
+            xmin, ymin, xmax, ymax = e.getBoundingBox()
+            centers.append(((xmin + xmax) / 2, (ymin + ymax) / 2))
+        table.center_x = np.array([c[0] for c in centers], dtype=np.float64)
+        table.center_y = np.array([c[1] for c in centers], dtype=np.float64)
+        table.length = np.array([e.getLength() for e in edges], dtype=np.float64)
+        table.speed = np.array([e.getSpeed() for e in edges], dtype=np.float64)
+        table.lanes = np.array([e.getLaneNumber() for e in edges], dtype=np.int32)
+        fringe = []
+        permissions = []
+        laneMasks = {}
+
+        def permissionMask(classes):
+            mask = 0
+            for vClass in classes:
+                if vClass in classIndex:
+                    mask |= 1 << classIndex[vClass]
+            return mask
+
+        def laneMask(lane):
+            if lane not in laneMasks:
+                laneMasks[lane] = permissionMask(lane.getPermissions())
+            return laneMasks[lane]
+
+        edgeIndex = dict([(e.getID(), i) for i, e in enumerate(edges)])
+        succPtr = [0]
+        succEdge = []
+        succPermissions = []
+        for e in edges:
+            flags = 0
+            if e.is_fringe():
+                flags |= FRINGE
+            if e.is_fringe(e._incoming):
+                flags |= FRINGE_INCOMING
+            if e.is_fringe(e._outgoing):
+                flags |= FRINGE_OUTGOING
+            if e.is_fringe(checkJunctions=True):
+                flags |= FRINGE_JUNCTION
+            if e.is_fringe(e._incoming, checkJunctions=True):
+                flags |= FRINGE_INCOMING_JUNCTION
+            if e.is_fringe(e._outgoing, checkJunctions=True):
+                flags |= FRINGE_OUTGOING_JUNCTION
+            fringe.append(flags)
+            permissions.append(permissionMask(e.getPermissions()))
+            successors = []
+            for toEdge, connections in e.getOutgoing().items():
+                if toEdge.getID() not in edgeIndex:
+                    continue
+                mask = 0
+                for c in connections:
+                    mask |= permissionMask(c._allowed) & laneMask(c.getFromLane()) & laneMask(c.getToLane())
+                successors.append((edgeIndex[toEdge.getID()], mask))
+            successors.sort()
+            succEdge += [to for to, mask in successors]
+            succPermissions += [mask for to, mask in successors]
+            succPtr.append(len(succEdge))
+        table.fringe = np.array(fringe, dtype=np.uint8)
+        table.roundabout = np.array([e.getID() in roundabouts for e in edges], dtype=bool)
+        table.permissions = np.array(permissions, dtype=np.uint64)
+        table.succ_ptr = np.array(succPtr, dtype=np.int64)
+        table.succ_edge = np.array(succEdge, dtype=np.int32)
+        table.succ_permissions = np.array(succPermissions, dtype=np.uint64)
+        return table
+
+    # numeric columns, saved as one .npy file each so they can be memory mapped
+    COLUMNS = ("from_node", "to_node", "from_x", "from_y", "to_x", "to_y", "center_x", "center_y",
+               "length", "speed", "lanes", "fringe", "roundabout", "permissions",
+               "succ_ptr", "succ_edge", "succ_permissions")
+
+    def save(self, path):
+        """write the table to directory path (replacing it atomically)"""
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmpDir = tempfile.mkdtemp(dir=parent)
+        try:
+            for column in self.COLUMNS:
+                np.save(os.path.join(tmpDir, column + ".npy"), getattr(self, column))
+            meta = {
+                "version": NET_CACHE_VERSION,
+                "ids": self.ids,
+                "types": self.types,
+                "params": self.params,
+                "node_ids": self.node_ids,
+                "vclasses": self.vclasses,
+                "boundary": list(self.boundary),
+                "bbox_diameter": self.bbox_diameter,
+            }
+            # meta.json is written last and marks the snapshot as complete
+            with open(os.path.join(tmpDir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmpDir, path)
+        except OSError:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != NET_CACHE_VERSION:
+            raise ValueError("outdated net cache '%s'" % path)
+        table = cls()
+        table.ids = meta["ids"]
+        table.types = meta["types"]
+        table.params = meta["params"]
+        table.node_ids = meta["node_ids"]
+        table.vclasses = meta["vclasses"]
+        table.boundary = tuple(meta["boundary"])
+        table.bbox_diameter = meta["bbox_diameter"]
+        for column in cls.COLUMNS:
+            setattr(table, column, np.load(os.path.join(path, column + ".npy"), mmap_mode="r"))
+        return table
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lane_index(self):
+        """return a dict from lane id to row (lanes are numbered from 0 per edge)"""
+        return dict([("%s_%s" % (edgeID, i), index)
+                     for index, (edgeID, lanes) in enumerate(zip(self.ids, self.lanes.tolist()))
+                     for i in range(lanes)])
+
+    def fringe_flag(self, connections=None, checkJunctions=False):
+        """return the bit of self.fringe which corresponds to
+        edge.is_fringe(getattr(edge, connections), checkJunctions)"""
+        if connections is None:
+            return FRINGE_JUNCTION if checkJunctions else FRINGE
+        if connections == "_incoming":
+            return FRINGE_INCOMING_JUNCTION if checkJunctions else FRINGE_INCOMING
+        return FRINGE_OUTGOING_JUNCTION if checkJunctions else FRINGE_OUTGOING
+
+    def is_fringe(self, index, connections=None, checkJunctions=False):
+        return bool(self.fringe[index] & self.fringe_flag(connections, checkJunctions))
+
+    def vclass_mask(self, vClass):
+        if vClass is None or vClass == "ignoring":
+            return None
+        if vClass not in self.vclasses:
+            return 0
+        return 1 << self.vclasses.index(vClass)
+
+    def allowed(self, vClass):
+        """return a boolean array telling which edges permit the given vehicle class"""
+        mask = self.vclass_mask(vClass)
+        if mask is None:
+            return np.ones(len(self), dtype=bool)
+        return (self.permissions & np.uint64(mask)) != 0
+
+    def allows(self, index, vClass):
+        mask = self.vclass_mask(vClass)
+        return mask is None or (int(self.permissions[index]) & mask) != 0
+
+    def successors(self, vClass):
+        """return the successor lists of all edges restricted to connections
+        and edges which permit the given vehicle class"""
+        allowed = self.allowed(vClass)
+        mask = self.vclass_mask(vClass)
+        usable = allowed[self.succ_edge]
+        if mask is not None:
+            usable &= (self.succ_permissions & np.uint64(mask)) != 0
+        succEdge = self.succ_edge.tolist()
+        usable = usable.tolist()
+        allowed = allowed.tolist()
+        ptr = self.succ_ptr.tolist()
+        return [[succEdge[k] for k in range(ptr[i], ptr[i + 1]) if usable[k]] if allowed[i] else []
+                for i in range(len(self))]
+
+
+class ReachabilityIndex:
+
+    """Tells whether an edge can be reached from another edge for one vehicle class.
+    Each edge is labeled with its strongly connected component (-1 if the edge does
+    not permit the vehicle class) and the reachable components are kept as a bit
+    set per component of the condensed graph"""
+
+    def __init__(self, component, dagPtr, dagTo):
+        self.component = np.asarray(component)
+        self._component = self.component.tolist()
+        self.dag_ptr = np.asarray(dagPtr)
+        self.dag_to = np.asarray(dagTo)
+        ptr = self.dag_ptr.tolist()
+        to = self.dag_to.tolist()
+        # components are numbered in reverse topological order, so all
+        # successors of component c have smaller numbers
+        self._reach = []
+        for c in range(len(ptr) - 1):
+            bits = 1 << c
+            for d in to[ptr[c]:ptr[c + 1]]:
+                bits |= self._reach[d]
+            self._reach.append(bits)
+
+    @classmethod
+    def fromTable(cls, edges, vClass):
+        succ = edges.successors(vClass)
+        allowed = edges.allowed(vClass).tolist()
+        n = len(edges)
+        # iterative version of Tarjan's algorithm
+        index = [-1] * n
+        low = [0] * n
+        onStack = [False] * n
+        component = [-1] * n
+        stack = []
+        counter = 0
+        nComp = 0
+        for root in range(n):
+            if index[root] != -1 or not allowed[root]:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack[root] = True
+            work = [(root, 0)]
+            while work:
+                v, i = work[-1]
+                if i < len(succ[v]):
+                    work[-1] = (v, i + 1)
+                    w = succ[v][i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        onStack[w] = True
+                        work.append((w, 0))
+                    elif onStack[w]:
+                        low[v] = min(low[v], index[w])
+                    continue
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        onStack[w] = False
+                        component[w] = nComp
+                        if w == v:
+                            break
+                    nComp += 1
+        dag = [set() for _ in range(nComp)]
+        for v in range(n):
+            for w in succ[v]:
+                if component[v] != component[w]:
+                    dag[component[v]].add(component[w])
+        dagPtr = [0]
+        dagTo = []
+        for targets in dag:
+            dagTo += sorted(targets)
+            dagPtr.append(len(dagTo))
+        return cls(np.array(component, dtype=np.int32), np.array(dagPtr, dtype=np.int64),
+                   np.array(dagTo, dtype=np.int32))
+
+    def save(self, fname):
+        tmp = fname + ".tmp.npz"
+        np.savez(tmp, component=self.component, dag_ptr=self.dag_ptr, dag_to=self.dag_to)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(data["component"], data["dag_ptr"], data["dag_to"])
+
+    def reachable(self, source, sink):
+        c = self._component[source]
+        d = self._component[sink]
+        return c >= 0 and d >= 0 and (self._reach[c] >> d) & 1 == 1
+
+    def connects(self, route):
+        """whether each edge of route can be reached from its predecessor"""
+        return all([self.reachable(a, b) for a, b in zip(route[:-1], route[1:])])
+
+
+class LandmarkIndex:
+
+    """Lower bounds of the network distance between edges for one vehicle class by
+    the ALT method. The distance from edge a to edge b is the length of the edges
+    after a up to and including b. For each landmark edge L the distances from L and
+    to L are kept as columns, so by the triangle inequality
+    d(a, b) >= max(d(L, b) - d(L, a), d(a, L) - d(b, L)) for every L"""
+
+    # the landmarks are chosen among CANDIDATES_PER_LANDMARK * count edges by
+    # the bounds they give for SAMPLE_PAIRS random edge pairs
+    CANDIDATES_PER_LANDMARK = 4
+    SAMPLE_PAIRS = 2000
+
+    def __init__(self, length, fromLandmark, toLandmark):
+        self.length = np.asarray(length, dtype=np.float64)
+        self.from_landmark = np.asarray(fromLandmark)
+        self.to_landmark = np.asarray(toLandmark)
+
+    @staticmethod
+    def _dijkstra(adjacency, source):
+        dist = [math.inf] * len(adjacency)
+        dist[source] = 0.
+        heap = [(0., source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > dist[v]:
+                continue
+            for w, cost in adjacency[v]:
+                if d + cost < dist[w]:
+                    dist[w] = d + cost
+                    heapq.heappush(heap, (d + cost, w))
+        return dist
+
+    @classmethod
+    def fromTable(cls, edges, vClass, count):
+        succ = edges.successors(vClass)
+        length = edges.length.tolist()
+        n = len(edges)
+        forward = [[(w, length[w]) for w in succ[v]] for v in range(n)]
+        backward = [[] for _ in range(n)]
+        for v in range(n):
+            for w in succ[v]:
+                backward[w].append((v, length[w]))
+        allowed = edges.allowed(vClass)
+        candidates = np.flatnonzero(allowed)
+        fromLandmark = np.full((n, count), np.inf)
+        toLandmark = np.full((n, count), np.inf)
+        if len(candidates) == 0:
+            return cls(edges.length, fromLandmark, toLandmark)
+        # start at the edge of the largest strongly connected component farthest
+        # from the center, so that the first landmark reaches and is reached by
+        # most of the network (and not at a dead end fringe edge)
+        component = ReachabilityIndex.fromTable(edges, vClass).component
+        largest = np.argmax(np.bincount(component[candidates]))
+        core = candidates[component[candidates] == largest]
+        xmin, ymin, xmax, ymax = edges.boundary
+        centerDist = np.hypot(edges.center_x[core] - (xmin + xmax) / 2, edges.center_y[core] - (ymin + ymax) / 2)
+        first = int(core[np.argmax(centerDist)])
+        # candidates are collected by a farthest first traversal: the next one is the
+        # edge farthest from all candidates so far, measured in the direction in which
+        # it is closer (edges not connected to any candidate yet come first)
+        rng = np.random.default_rng(0)
+        a = rng.choice(candidates, cls.SAMPLE_PAIRS)
+        b = rng.choice(candidates, cls.SAMPLE_PAIRS)
+        candidateBounds = {}
+        nearest = np.full(n, np.inf)
+        landmark = first
+        while len(candidateBounds) < cls.CANDIDATES_PER_LANDMARK * count:
+            fromL = np.array(cls._dijkstra(forward, landmark))
+            toL = np.array(cls._dijkstra(backward, landmark))
+            with np.errstate(invalid="ignore"):
+                bounds = np.maximum(fromL[b] - fromL[a], toL[a] - toL[b])
+            candidateBounds[landmark] = np.where(np.isnan(bounds), 0., bounds)
+            nearest = np.minimum(nearest, np.minimum(fromL, toL))
+            nearest[landmark] = -1.
+            score = np.where(allowed, nearest, -1.)
+            landmark = int(np.argmax(score))
+            if score[landmark] < 0:
+                # all usable edges are candidates already
+                break
+        # the landmarks are picked greedily from the candidates by how much they raise
+        # the sum of the finite bounds of a sample of edge pairs
+        chosen = [first]
+        best = candidateBounds.pop(first)
+
+        def gain(c):
+            bounds = np.maximum(best, candidateBounds[c])
+            finite = np.isfinite(bounds)
+            return bounds[finite].sum()
+
+        while len(chosen) < count and candidateBounds:
+            landmark = max(candidateBounds, key=gain)
+            best = np.maximum(best, candidateBounds.pop(landmark))
+            chosen.append(landmark)
+        fromLandmark = np.empty((n, len(chosen)))
+        toLandmark = np.empty((n, len(chosen)))
+        for k, landmark in enumerate(chosen):
+            fromLandmark[:, k] = cls._dijkstra(forward, landmark)
+            toLandmark[:, k] = cls._dijkstra(backward, landmark)
+        return cls(edges.length, fromLandmark, toLandmark)
+
+    def save(self, fname):
+        tmp = fname + ".tmp.npz"
+        np.savez(tmp, length=self.length, from_landmark=self.from_landmark, to_landmark=self.to_landmark)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(data["length"], data["from_landmark"], data["to_landmark"])
+
+    def lower_bounds(self, a, b):
+        """return the lower bounds of d(a, b) for the edge index arrays a and b
+        (inf if b cannot be reached from a)"""
+        with np.errstate(invalid="ignore"):
+            bounds = np.concatenate([self.from_landmark[b] - self.from_landmark[a],
+                                     self.to_landmark[a] - self.to_landmark[b]], axis=-1)
+        # nan means that neither edge is connected to the landmark
+        return np.maximum(np.where(np.isnan(bounds), 0., bounds).max(axis=-1), 0.)
+
+    def route_length(self, route):
+        """return a lower bound of the length of a route through the given edges"""
+        return float(self.length[route[0]] + self.lower_bounds(route[:-1], route[1:]).sum())
+
+    def route_lengths(self, routes):
+        """route_length for each row of the edge index array routes"""
+        return self.length[routes[:, 0]] + self.lower_bounds(routes[:, :-1], routes[:, 1:]).sum(axis=1)
+
+
+def loadNetIndex(options, fname, load, build, what):
+    """return the index loaded from fname in the network snapshot directory when
+    --net-cache is set or built (and stored) otherwise"""
+    path = None
+    if options.netCache:
+        cachePath = getNetCachePath(options.netCache, options.netfile)
+        if os.path.isdir(cachePath):
+            path = os.path.join(cachePath, fname)
+            if os.path.isfile(path):
+                try:
+                    return load(path)
+                except (IOError, OSError, ValueError, KeyError) as e:
+                    print("Warning: Could not load %s (%s), rebuilding." % (what, e), file=sys.stderr)
+    index = build()
+    if path:
+        try:
+            index.save(path)
+        except (IOError, OSError) as e:
+            print("Warning: Could not write %s (%s)." % (what, e), file=sys.stderr)
+    return index
+
+
+def loadReachability(options):
+    """return the ReachabilityIndex for options.edge_permission, stored in the
+    network snapshot directory when --net-cache is set"""
+    vClass = options.edge_permission
+    return loadNetIndex(options, "reach_%s.npz" % vClass, ReachabilityIndex.load,
+                        lambda: ReachabilityIndex.fromTable(options.edgeTable, vClass), "reachability index")
+
+
+def loadLandmarks(options):
+    """return the LandmarkIndex for options.edge_permission, stored in the
+    network snapshot directory when --net-cache is set"""
+    vClass = options.edge_permission
+    landmarks = loadNetIndex(options, "landmarks_%s_%s.npz" % (vClass, options.landmarks), LandmarkIndex.load,
+                             lambda: LandmarkIndex.fromTable(options.edgeTable, vClass, options.landmarks),
+                             "landmark index")
+    if landmarks.from_landmark.shape[1] < options.landmarks:
+        print("Warning: Only %s of %s landmarks could be placed for vClass '%s'." % (
+            landmarks.from_landmark.shape[1], options.landmarks, vClass), file=sys.stderr)
+    return landmarks
+
+
+def getNetFingerprint(netfile):
+    """return a key which changes whenever netfile is modified"""
+    stat = os.stat(netfile)
+    key = "%s|%s|%s" % (os.path.abspath(netfile), stat.st_size, stat.st_mtime)
+    return hashlib.sha1(key.encode("utf8")).hexdigest()
+
+
+def getNetCachePath(cacheDir, netfile):
+    """return the snapshot directory for the current state of netfile"""
+    return os.path.join(cacheDir, getNetFingerprint(netfile))
+
+
+def loadEdgeTable(netfile, cacheDir=None, verbose=False):
+    """return the sumolib net (None if a cached snapshot was used) and the EdgeTable for netfile"""
+    cachePath = None
+    if cacheDir:
+        cachePath = getNetCachePath(cacheDir, netfile)
+        if os.path.isfile(os.path.join(cachePath, "meta.json")):
+            try:
+                table = EdgeTable.load(cachePath)
+                if verbose:
+                    print("Loaded network snapshot '%s'" % cachePath)
+                return None, table
+            except (IOError, OSError, ValueError, KeyError) as e:
+                print("Warning: Could not load network snapshot (%s), rebuilding." % e, file=sys.stderr)
+    net = sumolib.net.readNet(netfile)
+    table = EdgeTable.fromNet(net)
+    if cachePath:
+        try:
+            table.save(cachePath)
+            if verbose:
+                print("Wrote network snapshot '%s'" % cachePath)
+        except (IOError, OSError) as e:
+            print("Warning: Could not write network snapshot (%s)." % e, file=sys.stderr)
+    return net, table
 
 
-# assigns a weight to each edge using weight_fun and then draws from a discrete
+# takes the weight of each edge from an array and then draws from a discrete
 # distribution with these weights
 
 
 class RandomEdgeGenerator:
 
-    def __init__(self, net, weight_fun):
-        self.net = net
-        self.weight_fun = weight_fun
-        self.cumulative_weights = []
-        self.total_weight = 0
-        for edge in self.net._edges:
-            # print edge.getID(), weight_fun(edge)
-            self.total_weight += weight_fun(edge)
-            self.cumulative_weights.append(self.total_weight)
+    def __init__(self, edges, weights, sampler="bisect"):
+        self.edges = edges
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.sampler = sampler
+        # np.cumsum adds sequentially and thus matches a running Python sum
+        self._cumulative_array = np.cumsum(self.weights)
+        self.cumulative_weights = self._cumulative_array.tolist()
+        self.total_weight = self.cumulative_weights[-1] if self.cumulative_weights else 0
         if self.total_weight == 0:
             raise InvalidGenerator()
+        self._random = random
+        self._rng = None
+        if sampler == "alias":
+            self._build_alias_table(self.weights.tolist())
+
+    def _build_alias_table(self, weights):
+        # Vose's alias method restricted to the edges with positive weight so
+        # that numerical leftovers can never select a forbidden edge
+        support = [i for i, w in enumerate(weights) if w > 0]
+        n = len(support)
+        scaled = [weights[i] * n / self.total_weight for i in support]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [j for j, p in enumerate(scaled) if p < 1]
+        large = [j for j, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] = (scaled[g] + scaled[s]) - 1
+            if scaled[g] < 1:
+                small.append(g)
+            else:
+                large.append(g)
+        # plain lists for single draws, arrays for batch draws
+        self._alias_prob = prob
+        self._alias_edge = support
+        self._alias_other = [support[j] for j in alias]
+        self._alias_prob_array = np.array(prob, dtype=np.float64)
+        self._alias_edge_array = np.array(support, dtype=np.int64)
+        self._alias_other_array = np.array(self._alias_other, dtype=np.int64)
+
+    def reset_rng(self):
+        self._rng = None
+
+    def set_random(self, rand):
+        """draw from the random.Random instance rand instead of the random module"""
+        self._random = rand
+        self._rng = None
+
+    def _get_rng(self):
+        # batch draws use their own stream which is seeded from the global one
+        # to stay reproducible for a given --seed
+        if self._rng is None:
+            self._rng = np.random.default_rng(self._random.getrandbits(64))
+        return self._rng
 
     def get(self):
-        r = random.random() * self.total_weight
-        index = bisect.bisect(self.cumulative_weights, r)
-        return self.net._edges[index]
+        """draw an edge and return its index into the EdgeTable"""
+        if self.sampler == "alias":
+            u = self._random.random() * len(self._alias_prob)
+            j = int(u)
+            if u - j < self._alias_prob[j]:
+                return self._alias_edge[j]
+            return self._alias_other[j]
+        r = self._random.random() * self.total_weight
+        return bisect.bisect(self.cumulative_weights, r)
+
+    def get_many(self, n):
+        """draw n edges at once and return their indices as an array"""
+        rng = self._get_rng()
+        if self.sampler == "alias":
+            size = len(self._alias_prob_array)
+            u = rng.random(n) * size
+            j = np.minimum(u.astype(np.int64), size - 1)
+            return np.where(u - j < self._alias_prob_array[j],
+                            self._alias_edge_array[j], self._alias_other_array[j])
+        r = rng.random(n) * self.total_weight
+        index = np.searchsorted(self._cumulative_array, r, side="right")
+        return np.minimum(index, len(self._cumulative_array) - 1)
 
     def write_weights(self, fname, interval_id, begin, end):
         # normalize to [0,100]
-        normalizer = 100.0 / max(1, max(map(self.weight_fun, self.net._edges)))
-        weights = [(self.weight_fun(e) * normalizer, e.getID()) for e in self.net.getEdges()]
+        normalizer = 100.0 / max(1, self.weights.max())
+        weights = list(zip((self.weights * normalizer).tolist(), self.edges.ids))
         weights.sort(reverse=True)
         total = sum([w for w, e in weights])
         with openz(fname, 'w+') as f:
@@ -395,39 +1328,153 @@ class RandomEdgeGenerator:
 
 class RandomTripGenerator:
 
-    def __init__(self, source_generator, sink_generator, via_generator, intermediate, pedestrians):
+    def __init__(self, source_generator, sink_generator, via_generator, intermediate, pedestrians, batch_size=0,
+                 reachability=None, landmarks=None):
         self.source_generator = source_generator
         self.sink_generator = sink_generator
         self.via_generator = via_generator
         self.intermediate = intermediate
         self.pedestrians = pedestrians
+        self.batch_size = batch_size
+        self.reachability = reachability
+        self.landmarks = landmarks
+        self._buffer = deque()
+        self._buffer_key = None
+        edges = source_generator.edges
+        # plain lists for the sequential search, arrays for batches
+        self._from_coord = list(zip(edges.from_x.tolist(), edges.from_y.tolist()))
+        self._to_coord = list(zip(edges.to_x.tolist(), edges.to_y.tolist()))
+        self._from_node = edges.from_node.tolist()
+        self._to_node = edges.to_node.tolist()
+        self._fringe = (edges.fringe & FRINGE).astype(bool)
+        self._is_fringe = self._fringe.tolist()
+        self._edges = edges
 
     def get_trip(self, min_distance, max_distance, maxtries=100, junctionTaz=False, min_dist_fringe=None):
+        """return the indices of source, sink and intermediate edges of a trip"""
+        if self.batch_size > 0:
+            return self._get_buffered_trip(min_distance, max_distance, maxtries, junctionTaz, min_dist_fringe)
+        tries = 0
         for min_dist in [min_distance, min_dist_fringe]:
             if min_dist is None:
                 break
             for _ in range(maxtries):
+                tries += 1
                 source_edge = self.source_generator.get()
                 intermediate = [self.via_generator.get() for __ in range(self.intermediate)]
                 sink_edge = self.sink_generator.get()
-                is_fringe2fringe = source_edge.is_fringe() and sink_edge.is_fringe() and not intermediate
+                is_fringe2fringe = self._is_fringe[source_edge] and self._is_fringe[sink_edge] and not intermediate
                 if min_dist == min_dist_fringe and not is_fringe2fringe:
                     continue
-                if self.pedestrians:
-                    destCoord = sink_edge.getFromNode().getCoord()
+                if self.landmarks is not None:
+                    distance = self.landmarks.route_length([source_edge] + intermediate + [sink_edge])
+                    if distance == math.inf:
+                        continue
                 else:
-                    destCoord = sink_edge.getToNode().getCoord()
-                coords = ([source_edge.getFromNode().getCoord()] +
-                          [e.getFromNode().getCoord() for e in intermediate] +
-                          [destCoord])
-                distance = sum([euclidean(p, q)
-                                for p, q in zip(coords[:-1], coords[1:])])
+                    if self.pedestrians:
+                        destCoord = self._from_coord[sink_edge]
+                    else:
+                        destCoord = self._to_coord[sink_edge]
+                    coords = ([self._from_coord[source_edge]] +
+                              [self._from_coord[e] for e in intermediate] +
+                              [destCoord])
+                    distance = sum([euclidean(p, q)
+                                    for p, q in zip(coords[:-1], coords[1:])])
                 if (distance >= min_dist
-                        and (not junctionTaz or source_edge.getFromNode() != sink_edge.getToNode())
-                        and (max_distance is None or distance < max_distance)):
+                        and (not junctionTaz or self._from_node[source_edge] != self._to_node[sink_edge])
+                        and (max_distance is None or distance < max_distance)
+                        and (self.reachability is None
+                             or self.reachability.connects([source_edge] + intermediate + [sink_edge]))):
+                    RUN_PROFILE.count("samples drawn", tries)
+                    RUN_PROFILE.count("samples accepted")
                     return source_edge, sink_edge, intermediate
+        RUN_PROFILE.count("samples drawn", tries)
         raise Exception("Warning: no trip found after %s tries" % maxtries)
 
+    def with_edge_generators(self, source_generator, sink_generator, via_generator):
+        """return a copy which shares the edge data but draws from other edge generators"""
+        result = copy.copy(self)
+        result.source_generator = source_generator
+        result.sink_generator = sink_generator
+        result.via_generator = via_generator
+        result._buffer = deque()
+        result._buffer_key = None
+        return result
+
+    def start_shard(self, offset):
+        """prepare for drawing in a worker process after reseeding the random module"""
+        self._buffer.clear()
+        for generator in (self.source_generator, self.sink_generator, self.via_generator):
+            if generator is not None:
+                generator.reset_rng()
+
+    def start_interval(self, streams):
+        """draw the edges from the random streams of an interval (a SeedStreams)"""
+        self._buffer.clear()
+        self.source_generator.set_random(streams.source)
+        self.sink_generator.set_random(streams.sink)
+        if self.via_generator is not None:
+            self.via_generator.set_random(streams.via)
+
+    def _get_buffered_trip(self, min_distance, max_distance, maxtries, junctionTaz, min_dist_fringe):
+        key = (min_distance, max_distance, maxtries, junctionTaz, min_dist_fringe)
+        if key != self._buffer_key:
+            self._buffer.clear()
+            self._buffer_key = key
+        if not self._buffer:
+            self._fill_buffer(*key)
+        return self._buffer.popleft()
+
+    def _fill_buffer(self, min_distance, max_distance, maxtries, junctionTaz, min_dist_fringe):
+        n = max(self.batch_size, maxtries)
+        sources, sinks, vias, accepted = self.sample_batch(n, min_distance, max_distance, junctionTaz,
+                                                           min_dist_fringe)
+        RUN_PROFILE.count("samples drawn", n)
+        RUN_PROFILE.count("samples accepted", int(accepted.sum()))
+        if not accepted.any():
+            raise Exception("Warning: no trip found after %s tries" % n)
+        for i in np.flatnonzero(accepted):
+            self._buffer.append((int(sources[i]), int(sinks[i]), vias[i].tolist()))
+
+    def sample_batch(self, n, min_distance, max_distance, junctionTaz, min_dist_fringe):
+        """draw n candidate trips and apply the distance constraints of get_trip to all
+        of them at once. Returns the arrays of sources, sinks, vias (one row per candidate)
+        and the boolean array of the accepted candidates"""
+        sources = self.source_generator.get_many(n)
+        sinks = self.sink_generator.get_many(n)
+        if self.intermediate > 0:
+            vias = self.via_generator.get_many(n * self.intermediate).reshape(n, self.intermediate)
+        else:
+            vias = np.empty((n, 0), dtype=np.int64)
+        edges = self._edges
+        if self.landmarks is not None:
+            distance = self.landmarks.route_lengths(np.column_stack([sources, vias, sinks]))
+            valid = np.isfinite(distance)
+        else:
+            points = [(edges.from_x[sources], edges.from_y[sources])]
+            points += [(edges.from_x[vias[:, k]], edges.from_y[vias[:, k]]) for k in range(self.intermediate)]
+            if self.pedestrians:
+                points.append((edges.from_x[sinks], edges.from_y[sinks]))
+            else:
+                points.append((edges.to_x[sinks], edges.to_y[sinks]))
+            distance = np.zeros(n)
+            for p, q in zip(points[:-1], points[1:]):
+                distance += np.hypot(p[0] - q[0], p[1] - q[1])
+            valid = np.ones(n, dtype=bool)
+        if junctionTaz:
+            valid &= edges.from_node[sources] != edges.to_node[sinks]
+        if max_distance is not None:
+            valid &= distance < max_distance
+        if self.reachability is not None:
+            route = np.column_stack([sources, vias, sinks]).tolist()
+            for i in np.flatnonzero(valid):
+                valid[i] = self.reachability.connects(route[i])
+        accepted = valid & (distance >= min_distance)
+        if not accepted.any() and min_dist_fringe is not None and self.intermediate == 0:
+            # fall back to fringe-to-fringe trips like the sequential search does
+            accepted = valid & self._fringe[sources] & self._fringe[sinks] & (distance >= min_dist_fringe)
+        return sources, sinks, vias, accepted
+
 
 class CachedTripGenerator:
 
@@ -440,120 +1487,316 @@ class CachedTripGenerator:
         self._nCalled += 1
         return result
 
+    def start_shard(self, offset):
+        self._nCalled = offset
+
+
+class ProfileTripGenerator:
+
+    """Draws the trips of each interval of a demand profile from a generator with the
+    edge weights of that interval. The weights are the base weights times the factors
+    of the interval, generators are built once per distinct set of factors"""
+
+    def __init__(self, base, options):
+        self.base = base
+        self.times = options.intervalTimes
+        edges = base.source_generator.edges
+        self._edges = edges
+        self._edgeIndex = dict([(edgeID, i) for i, edgeID in enumerate(edges.ids)])
+        self._types = np.array(edges.types, dtype=object)
+        cache = {(): base}
+        self.generators = []
+        for overrides in options.intervalOverrides:
+            if overrides not in cache:
+                cache[overrides] = self._build(overrides, options.edge_sampler)
+            self.generators.append(cache[overrides])
+        self._distinct = list(cache.values())
+        if options.verbose:
+            print("Built %s trip generators for %s intervals." % (len(self._distinct), len(self.generators)))
+
+    def _build(self, overrides, sampler):
+        base = self.base
+        n = len(self._edges)
+        factors = {"src": np.ones(n), "dst": np.ones(n), "via": np.ones(n)}
+        for selector, selectorID, which, factor in overrides:
+            if selector == "edge":
+                if selectorID not in self._edgeIndex:
+                    raise ValueError("Unknown edge '%s' in demand profile." % selectorID)
+                factors[which][self._edgeIndex[selectorID]] *= factor
+            else:
+                factors[which][self._types == selectorID] *= factor
+        via_generator = base.via_generator
+        if via_generator is not None:
+            via_generator = RandomEdgeGenerator(self._edges, via_generator.weights * factors["via"], sampler)
+        return base.with_edge_generators(
+            RandomEdgeGenerator(self._edges, base.source_generator.weights * factors["src"], sampler),
+            RandomEdgeGenerator(self._edges, base.sink_generator.weights * factors["dst"], sampler),
+            via_generator)
+
+    @property
+    def source_generator(self):
+        return self.base.source_generator
+
+    @property
+    def sink_generator(self):
+        return self.base.sink_generator
+
+    @property
+    def via_generator(self):
+        return self.base.via_generator
+
+    def generatorAt(self, time):
+        """return the trip generator of the interval containing time"""
+        index = bisect.bisect_right(self.times, time) - 1
+        return self.generators[min(max(index, 0), len(self.generators) - 1)]
+
+    def get_trip(self, *args, **kwargs):
+        return self.base.get_trip(*args, **kwargs)
+
+    def start_shard(self, offset):
+        for generator in self._distinct:
+            generator.start_shard(offset)
+
+    def start_interval(self, streams):
+        for generator in self._distinct:
+            generator.start_interval(streams)
+
 
-def get_prob_fun(options, fringe_bonus, fringe_forbidden, max_length):
+class EdgeFeatures:
+
+    """Per-edge factors which depend on the options but not on the kind of
+    generator (source, sink or via). They are computed once per run"""
+
+    def __init__(self, options):
+        edges = options.edgeTable
+        self.typeFactor = np.array([options.typeFactors[t] for t in edges.types], dtype=np.float64)
+        self.param = None
+        if options.edgeParam is not None:
+            self.param = np.array([float(p.get(options.edgeParam, 1.0)) for p in edges.params], dtype=np.float64)
+        self.angleDiff = None
+        if options.angle_weight != 1.0:
+            nx, ny = options.angle_center
+            self.angleDiff = np.array([minAngleDegreeDiff(options.angle, naviDegree(math.atan2(ey - ny, ex - nx)))
+                                       for ex, ey in zip(edges.center_x.tolist(), edges.center_y.tolist())],
+                                      dtype=np.float64)
+        self._speedPowers = {}
+        self._speed = edges.speed
+
+    def speed_power(self, exponent):
+        """return speed ** exponent for all edges"""
+        if exponent not in self._speedPowers:
+            # use Python's pow on the few distinct speeds so the values do
+            # not depend on numpy's vectorized power implementation
+            speeds, inverse = np.unique(self._speed, return_inverse=True)
+            powers = np.array([v ** exponent for v in speeds.tolist()], dtype=np.float64)
+            self._speedPowers[exponent] = powers[inverse.reshape(-1)]
+        return self._speedPowers[exponent]
+
+
+def get_edge_features(options):
+    if getattr(options, "edgeFeatures", None) is None:
+        options.edgeFeatures = EdgeFeatures(options)
+    return options.edgeFeatures
+
+
+def get_edge_weights(options, fringe_bonus, fringe_forbidden, max_length):
+    """return the array of edge weights for a source ("_incoming" fringe bonus),
+    sink ("_outgoing") or via (None) generator. The factors are applied in the
+    same order as by the scalar function of earlier versions so the weights
+    are bitwise identical"""
     # fringe_bonus None generates intermediate way points
-    randomProbs = defaultdict(lambda: 1)
+    edges = options.edgeTable
+    features = get_edge_features(options)
+    n = len(edges)
     if options.randomFactor != 1:
-        for edge in options.net.getEdges():
-            randomProbs[edge.getID()] = random.uniform(1, options.randomFactor)
-
-    roundabouts = set()
-    if not options.allowRoundabouts:
-        for roundabout in options.net.getRoundabouts():
-            roundabouts.update(roundabout.getEdges())
+        prob = np.array([random.uniform(1, options.randomFactor) for _ in range(n)], dtype=np.float64)
+    else:
+        prob = np.ones(n, dtype=np.float64)
 
     stopDict = None
     if options.fromStops and fringe_bonus == "_incoming":
         stopDict = options.edgeFromStops
+        stopCounts = options.fromStopCounts
     elif options.toStops and fringe_bonus == "_outgoing":
         stopDict = options.edgeToStops
-
-    def edge_probability(edge):
-        bonus_connections = None if fringe_bonus is None else getattr(edge, fringe_bonus)
-        forbidden_connections = None if fringe_forbidden is None else getattr(edge, fringe_forbidden)
-        if options.edge_permission and not edge.allows(options.edge_permission) and not stopDict:
-            return 0  # not allowed
-        if fringe_bonus is None and edge.is_fringe() and not options.pedestrians:
-            return 0  # not suitable as intermediate way point
-        if (fringe_forbidden is not None and
-                edge.is_fringe(forbidden_connections) and
-                not options.pedestrians and
-                (options.allow_fringe_min_length is None or edge.getLength() < options.allow_fringe_min_length)):
-            return 0  # the wrong kind of fringe
-        if (fringe_bonus is not None and options.viaEdgeTypes is not None and
-                not edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions) and
-                edge.getType() in options.viaEdgeTypes):
-            return 0  # the wrong type of edge (only allows depart and arrival on the fringe)
-        if fringe_bonus is not None and edge.getID() in roundabouts:
-            return 0  # traffic typically does not start/end inside a roundabout
-        prob = randomProbs[edge.getID()]
-        if stopDict:
-            prob *= len(stopDict[edge.getID()])
-        if options.length:
-            if (options.fringe_factor != 1.0 and fringe_bonus is not None and
-                    edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions)):
-                # short fringe edges should not suffer a penalty
-                prob *= max_length
-            else:
-                prob *= edge.getLength()
-        if options.lanes:
-            prob *= edge.getLaneNumber()
-        if edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions):
-            prob *= (edge.getSpeed() ** options.fringe_speed_exponent)
-        else:
-            prob *= (edge.getSpeed() ** options.speed_exponent)
+        stopCounts = options.toStopCounts
+
+    fringe = edges.fringe
+    anyFringe = (fringe & edges.fringe_flag()) != 0
+    bonusFringe = (fringe & edges.fringe_flag(fringe_bonus, options.fringeJunctions)) != 0
+    zero = np.zeros(n, dtype=bool)
+    if options.edge_permission and not stopDict:
+        zero |= ~edges.allowed(options.edge_permission)  # not allowed
+    if fringe_bonus is None and not options.pedestrians:
+        zero |= anyFringe  # not suitable as intermediate way point
+    if fringe_forbidden is not None and not options.pedestrians:
+        forbidden = (fringe & edges.fringe_flag(fringe_forbidden)) != 0
+        if options.allow_fringe_min_length is not None:
+            forbidden &= edges.length < options.allow_fringe_min_length
+        zero |= forbidden  # the wrong kind of fringe
+    if fringe_bonus is not None and options.viaEdgeTypes is not None:
+        viaType = np.array([t in options.viaEdgeTypes for t in edges.types], dtype=bool)
+        zero |= ~bonusFringe & viaType  # the wrong type of edge (only allows depart and arrival on the fringe)
+    if fringe_bonus is not None and not options.allowRoundabouts:
+        zero |= edges.roundabout  # traffic typically does not start/end inside a roundabout
+
+    if stopDict:
+        prob *= stopCounts
+    if options.length:
         if options.fringe_factor != 1.0 and fringe_bonus is not None:
-            isFringe = (edge.getSpeed() > options.fringe_threshold and
-                        edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions))
-            if isFringe and options.fringe_factor != MAXIMIZE_FACTOR:
-                prob *= options.fringe_factor
-            elif not isFringe and options.fringe_factor == MAXIMIZE_FACTOR:
-                prob = 0
-        if options.edgeParam is not None:
-            prob *= float(edge.getParam(options.edgeParam, 1.0))
-        if options.angle_weight != 1.0 and fringe_bonus is not None:
-            xmin, ymin, xmax, ymax = edge.getBoundingBox()
-            ex, ey = ((xmin + xmax) / 2, (ymin + ymax) / 2)
-            nx, ny = options.angle_center
-            edgeAngle = naviDegree(math.atan2(ey - ny, ex - nx))
-            angleDiff = minAngleDegreeDiff(options.angle, edgeAngle)
-            # print("e=%s nc=%s ec=%s ea=%s a=%s ad=%s" % (
-            #    edge.getID(), options.angle_center, (ex,ey), edgeAngle,
-            #    options.angle, angleDiff))
-            # relDist = 2 * euclidean((ex, ey), options.angle_center) / max(xmax - xmin, ymax - ymin)
-            # prob *= (relDist * (options.angle_weight - 1) + 1)
-            if fringe_bonus == "_incoming":
-                # source edge
-                prob *= (angleDiff * (options.angle_weight - 1) + 1)
-            else:
-                prob *= ((180 - angleDiff) * (options.angle_weight - 1) + 1)
-        prob *= options.typeFactors[edge.getType()]
-
-        return prob
-    return edge_probability
-
-
-class LoadedProps:
+            # short fringe edges should not suffer a penalty
+            prob *= np.where(bonusFringe, max_length, edges.length)
+        else:
+            prob *= edges.length
+    if options.lanes:
+        prob *= edges.lanes
+    prob *= np.where(bonusFringe, features.speed_power(options.fringe_speed_exponent),
+                     features.speed_power(options.speed_exponent))
+    if options.fringe_factor != 1.0 and fringe_bonus is not None:
+        isFringe = (edges.speed > options.fringe_threshold) & bonusFringe
+        if options.fringe_factor != MAXIMIZE_FACTOR:
+            prob *= np.where(isFringe, options.fringe_factor, 1.0)
+        else:
+            prob[~isFringe] = 0
+    if features.param is not None:
+        prob *= features.param
+    if features.angleDiff is not None and fringe_bonus is not None:
+        if fringe_bonus == "_incoming":
+            # source edge
+            prob *= features.angleDiff * (options.angle_weight - 1) + 1
+        else:
+            prob *= (180 - features.angleDiff) * (options.angle_weight - 1) + 1
+    prob *= features.typeFactor
+    prob[zero] = 0
+    return prob
+
+
+def loadEdgeCounts(fnames, attr, edges):
+    """return the sum of attribute attr over all edgeData intervals in fnames
+    per row of edges and a boolean array of the rows which have a count"""
+    index = dict([(edgeID, i) for i, edgeID in enumerate(edges.ids)])
+    counts = np.zeros(len(edges), dtype=np.float64)
+    observed = np.zeros(len(edges), dtype=bool)
+    for fname in fnames:
+        for _, edgeID, value in iterElements(fname, ("edge",), ("id", attr)):
+            i = index.get(edgeID)
+            if i is not None and value is not None:
+                counts[i] += float(value)
+                observed[i] = True
+    return counts, observed
+
+
+def getExpectedTrips(options):
+    """return the expected number of generated trips for options.period"""
+    times = getIntervalTimes(options)
+    return sum([(times[i + 1] - times[i]) / period for i, period in enumerate(options.period) if period > 0])
+
+
+def fitStep(weights, nDrawn, nAccepted, observed, target, rest):
+    """one proportional fitting step: estimate the share of the accepted trips of
+    each edge from the acceptance rate of its drawn candidates and scale the
+    weights of each counted edge and of all other edges together to their target
+    share. The target of counted edges with weight 0 or without any accepted
+    candidate goes to the other edges. Returns the new weights and the maximum
+    relative deviation of the fittable edges from their target before the step"""
+    n = len(weights)
+    # one pseudo candidate with the overall rate keeps rarely drawn edges from extreme estimates
+    acceptance = (nAccepted + nAccepted.sum() / max(nDrawn.sum(), 1)) / (nDrawn + 1)
+    effective = weights * acceptance
+    share = effective / effective.sum()
+    factor = np.ones(n)
+    fittable = observed & (share > 0) & ((nAccepted > 0) | (nDrawn == 0))
+    factor[fittable] = target[fittable] / share[fittable]
+    restShare = share[~observed].sum()
+    if restShare > 0:
+        factor[~observed] = (rest + target[observed & ~fittable].sum()) / restShare
+    counted = fittable & (target > 0)
+    deviation = np.abs(share[counted] / target[counted] - 1).max() if counted.any() else 0.
+    return weights * factor, deviation
+
+
+def fitWeights(trip_generator, options):
+    """return a copy of trip_generator whose source and sink weights are fitted
+    to the edge counts of --fit-counts by iterative proportional fitting"""
+    edges = options.edgeTable
+    nTrips = getExpectedTrips(options)
+    generators = [trip_generator.source_generator, trip_generator.sink_generator]
+    weights = [g.weights.copy() for g in generators]
+    targets = [None, None]
+    for k, attr in enumerate(options.fitAttributes):
+        if attr is None:
+            continue
+        counts, observed = loadEdgeCounts(options.fitCounts.split(','), attr, edges)
+        if not observed.any():
+            print("Warning: No '%s' counts found for the edges of the network." % attr, file=sys.stderr)
+            continue
+        unreachable = observed & (counts > 0) & (weights[k] == 0)
+        if unreachable.any():
+            print("Warning: Cannot fit the '%s' counts of %s edges with weight 0 (e.g. '%s')." % (
+                attr, unreachable.sum(), edges.ids[np.flatnonzero(unreachable)[0]]), file=sys.stderr)
+        total = counts[observed].sum()
+        if total > nTrips:
+            print("Warning: The '%s' counts (%s) exceed the expected number of trips (%s), fitting their ratios." % (
+                attr, total, int(nTrips)), file=sys.stderr)
+            targets[k] = (observed, counts / total, 0.)
+        else:
+            targets[k] = (observed, counts / nTrips, 1. - total / nTrips)
+    # candidates drawn and accepted per edge over all iterations
+    stats = [(np.zeros(len(edges)), np.zeros(len(edges))) for _ in range(2)]
+    for iteration in range(options.fitIterations):
+        sources, sinks, _, accepted = trip_generator.sample_batch(
+            options.fitSamples, options.min_distance, options.max_distance, options.junctionTaz,
+            options.min_dist_fringe)
+        deviation = 0.
+        for k, drawn in enumerate((sources, sinks)):
+            if targets[k] is None:
+                continue
+            nDrawn, nAccepted = stats[k]
+            nDrawn += np.bincount(drawn, minlength=len(edges))
+            nAccepted += np.bincount(drawn[accepted], minlength=len(edges))
+            observed, target, rest = targets[k]
+            weights[k], stepDeviation = fitStep(weights[k], nDrawn, nAccepted, observed, target, rest)
+            deviation = max(deviation, stepDeviation)
+        if options.verbose:
+            print("Fitting iteration %s: maximum relative deviation %.4f" % (iteration, deviation))
+        if deviation <= options.fitTolerance:
+            break
+        generators = [RandomEdgeGenerator(edges, w, options.edge_sampler) for w in weights]
+        trip_generator = trip_generator.with_edge_generators(generators[0], generators[1],
+                                                             trip_generator.via_generator)
+    else:
+        print("Warning: Fitting did not reach a deviation of %s after %s iterations (deviation %.4f)." % (
+            options.fitTolerance, options.fitIterations, deviation), file=sys.stderr)
+    return trip_generator
 
-    def __init__(self, fname):
-        self.weights = defaultdict(lambda: 0)
-        for edge in sumolib.xml.parse_fast(fname, 'edge', ['id', 'value']):
-            self.weights[edge.id] = float(edge.value)
 
-    def __call__(self, edge):
-        return self.weights[edge.getID()]
+def loadWeights(fname, edges):
+    """return the array of edge weights stored in fname (edgedata format)"""
+    weights = defaultdict(lambda: 0)
+    for edge in sumolib.xml.parse_fast(fname, 'edge', ['id', 'value']):
+        weights[edge.id] = float(edge.value)
+    return np.array([weights[edgeID] for edgeID in edges.ids], dtype=np.float64)
 
 
-def buildTripGenerator(net, options):
+def buildTripGenerator(edges, options):
     try:
         max_length = 0
-        for edge in net.getEdges():
-            if not edge.is_fringe():
-                max_length = max(max_length, edge.getLength())
+        for index in range(len(edges)):
+            if not edges.is_fringe(index):
+                max_length = max(max_length, float(edges.length[index]))
         forbidden_source_fringe = None if options.allow_fringe else "_outgoing"
         forbidden_sink_fringe = None if options.allow_fringe else "_incoming"
         source_generator = RandomEdgeGenerator(
-            net, get_prob_fun(options, "_incoming", forbidden_source_fringe, max_length))
+            edges, get_edge_weights(options, "_incoming", forbidden_source_fringe, max_length), options.edge_sampler)
         sink_generator = RandomEdgeGenerator(
-            net, get_prob_fun(options, "_outgoing", forbidden_sink_fringe, max_length))
+            edges, get_edge_weights(options, "_outgoing", forbidden_sink_fringe, max_length), options.edge_sampler)
         if options.weightsprefix:
             if os.path.isfile(options.weightsprefix + SOURCE_SUFFIX):
                 source_generator = RandomEdgeGenerator(
-                    net, LoadedProps(options.weightsprefix + SOURCE_SUFFIX))
+                    edges, loadWeights(options.weightsprefix + SOURCE_SUFFIX, edges), options.edge_sampler)
             if os.path.isfile(options.weightsprefix + DEST_SUFFIX):
                 sink_generator = RandomEdgeGenerator(
-                    net, LoadedProps(options.weightsprefix + DEST_SUFFIX))
+                    edges, loadWeights(options.weightsprefix + DEST_SUFFIX, edges), options.edge_sampler)
     except InvalidGenerator:
         print("Error: no valid edges for generating source or destination. Try using option --allow-fringe",
               file=sys.stderr)
@@ -561,10 +1804,10 @@ def buildTripGenerator(net, options):
 
     try:
         via_generator = RandomEdgeGenerator(
-            net, get_prob_fun(options, None, None, 1))
+            edges, get_edge_weights(options, None, None, 1), options.edge_sampler)
         if options.weightsprefix and os.path.isfile(options.weightsprefix + VIA_SUFFIX):
             via_generator = RandomEdgeGenerator(
-                net, LoadedProps(options.weightsprefix + VIA_SUFFIX))
+                edges, loadWeights(options.weightsprefix + VIA_SUFFIX, edges), options.edge_sampler)
     except InvalidGenerator:
         if options.intermediate > 0:
             print("Error: no valid edges for generating intermediate points", file=sys.stderr)
@@ -572,8 +1815,32 @@ def buildTripGenerator(net, options):
         else:
             via_generator = None
 
-    return RandomTripGenerator(
-        source_generator, sink_generator, via_generator, options.intermediate, options.pedestrians)
+    reachability = None
+    if options.checkReachability:
+        reachability = loadReachability(options)
+    landmarks = None
+    if options.networkDistance:
+        with RUN_PROFILE.phase("landmarks"):
+            landmarks = loadLandmarks(options)
+    trip_generator = RandomTripGenerator(
+        source_generator, sink_generator, via_generator, options.intermediate, options.pedestrians,
+        options.batch_size, reachability, landmarks)
+    if options.fitCounts:
+        try:
+            with RUN_PROFILE.phase("weight fit"):
+                trip_generator = fitWeights(trip_generator, options)
+        except InvalidGenerator:
+            print("Error: fitting the weights to the counts left no valid edges for generating trips",
+                  file=sys.stderr)
+            return None
+    if options.intervalOverrides:
+        try:
+            return ProfileTripGenerator(trip_generator, options)
+        except InvalidGenerator:
+            print("Error: no valid edges for generating trips with the weights of the demand profile",
+                  file=sys.stderr)
+            return None
+    return trip_generator
 
 
 def is_walk_attribute(attr):
@@ -659,8 +1926,8 @@ def prependSpace(s):
         return " " + s
 
 
-def samplePosition(edge):
-    return random.uniform(0.0, edge.getLength())
+def samplePosition(length, rand=random):
+    return rand.uniform(0.0, length)
 
 
 def getElement(options):
@@ -676,25 +1943,32 @@ def getElement(options):
             return "trip"
 
 
-def main(options):
-    if all([period == 0 for period in options.period]):
-        print("Warning: All intervals are empty.", file=sys.stderr)
-        return False
-
+def prepareTripGenerator(options):
+    """seed the random module and return the trip generator for options (or None)"""
     if not options.random:
         random.seed(options.seed)
 
-    if options.min_distance > options.net.getBBoxDiameter() * (options.intermediate + 1):
-        options.intermediate = int(math.ceil(options.min_distance / options.net.getBBoxDiameter())) - 1
+    diameter = options.edgeTable.bbox_diameter
+    if options.min_distance > diameter * (options.intermediate + 1) and not options.networkDistance:
+        options.intermediate = int(math.ceil(options.min_distance / diameter)) - 1
         print(("Warning: Using %s intermediate waypoints to achieve a minimum trip length of %s in a network "
-               "with diameter %.2f.") % (options.intermediate, options.min_distance, options.net.getBBoxDiameter()),
+               "with diameter %.2f.") % (options.intermediate, options.min_distance, diameter),
               file=sys.stderr)
 
     if options.angle_weight != 1:
-        xmin, ymin, xmax, ymax = options.net.getBoundary()
+        xmin, ymin, xmax, ymax = options.edgeTable.boundary
         options.angle_center = (xmin + xmax) / 2, (ymin + ymax) / 2
 
-    trip_generator = buildTripGenerator(options.net, options)
+    return buildTripGenerator(options.edgeTable, options)
+
+
+def main(options):
+    if all([period == 0 for period in options.period]):
+        print("Warning: All intervals are empty.", file=sys.stderr)
+        return False
+
+    with RUN_PROFILE.phase("weight build"):
+        trip_generator = prepareTripGenerator(options)
 
     if trip_generator and options.weights_outprefix:
         idPrefix = ""
@@ -711,71 +1985,332 @@ def main(options):
                 options.weights_outprefix + VIA_SUFFIX,
                 idPrefix + "via", options.begin, options.end)
 
-    createTrips(options, trip_generator)
+    if options.regenerateInterval is not None:
+        regenerateInterval(options, trip_generator)
+    else:
+        createTrips(options, trip_generator)
+    RUN_PROFILE.write(options)
 
     # return wether trips could be generated as requested
     return trip_generator is not None
 
 
-def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False):
-    idx = 0
+class ParallelGzipWriter(io.RawIOBase):
 
-    vtypeattrs, tripattrs, personattrs, otherattrs = split_trip_attributes(
-        options.tripattrs, options.pedestrians, options.vehicle_class, options.verbose)
+    """Binary output which compresses every written block in a thread pool.
+    Each block becomes a separate gzip member; the members are written in order"""
 
-    vias = {}
-    generatedTrips = []  # (label, origin, destination, intermediate)
-    validatedTrips = []  # (origin, destination, intermediate)
+    def __init__(self, fname, compressLevel=9, threads=2):
+        io.RawIOBase.__init__(self)
+        self._out = io.open(fname, "wb")
+        self._level = compressLevel
+        self._pool = ThreadPoolExecutor(threads)
+        self._pending = deque()
+        self._maxPending = 2 * threads
 
-    time_delta = (parseTime(options.end) - parseTime(options.begin)) / len(options.period)
-    times = [parseTime(options.begin) + i * time_delta for i in range(len(options.period) + 1)]
-    times = list(map(intIfPossible, times))
+    def writable(self):
+        return True
+
+    def write(self, b):
+        # the caller may reuse b, so compress a copy
+        self._pending.append(self._pool.submit(gzip.compress, bytes(b), self._level))
+        while len(self._pending) > self._maxPending:
+            self._out.write(self._pending.popleft().result())
+        return len(b)
+
+    def flush(self):
+        while self._pending:
+            self._out.write(self._pending.popleft().result())
+        self._out.flush()
+
+    def close(self):
+        if not self.closed:
+            io.RawIOBase.close(self)
+            self._pool.shutdown()
+            self._out.close()
+
+
+class BufferedOutput:
 
-    def generate_origin_destination(trip_generator, options):
-        source_edge, sink_edge, intermediate = trip_generator.get_trip(
-            options.min_distance, options.max_distance, options.maxtries,
-            options.junctionTaz, options.min_dist_fringe)
-        return source_edge, sink_edge, intermediate
+    """Text output which passes the many small writes of createTrips on in large blocks.
+    Gzip output may use a custom compression level and parallel compression threads"""
 
-    def generate_attributes(idx, departureTime, arrivalTime, origin, destination, intermediate, options):
-        label = "%s%s" % (options.tripprefix, idx)
+    def __init__(self, fname, blockSize=OUTPUT_BLOCK_SIZE, compressLevel=None, threads=0):
+        self._closeStream = fname not in ("stdout", "stderr")
+        if not self._closeStream:
+            self._stream = openz(fname, "w")
+        elif fname.endswith(".gz"):
+            level = 9 if compressLevel is None else compressLevel
+            if threads > 0:
+                raw = ParallelGzipWriter(fname, level, threads)
+            else:
+                raw = gzip.GzipFile(fname, "wb", compresslevel=level)
+            self._stream = io.TextIOWrapper(io.BufferedWriter(raw, blockSize), encoding="utf8")
+        else:
+            self._stream = io.open(fname, "w", encoding="utf8", buffering=blockSize)
+        # bind the C level method directly, this is called once per line
+        self.write = self._stream.write
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        if self._closeStream:
+            self._stream.close()
+        else:
+            self._stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def generate_origin_destination(trip_generator, options, depart=None):
+    if depart is not None and isinstance(trip_generator, ProfileTripGenerator):
+        trip_generator = trip_generator.generatorAt(depart)
+    source_edge, sink_edge, intermediate = trip_generator.get_trip(
+        options.min_distance, options.max_distance, options.maxtries,
+        options.junctionTaz, options.min_dist_fringe)
+    return source_edge, sink_edge, intermediate
+
+
+class GeneratedTrips:
+
+    """The trips written by a TripWriter as parallel integer arrays: the index from
+    the trip id, the source and sink edge index and the via edge indices of trip k as
+    via[via_offset[k]:via_offset[k + 1]]. Indexing returns (source, sink, via list)
+    so the validated trips can be used directly by CachedTripGenerator"""
+
+    def __init__(self):
+        self.index = array('q')
+        self.source = array('i')
+        self.sink = array('i')
+        self.via_offset = array('q', [0])
+        self.via = array('i')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, k):
+        return self.source[k], self.sink[k], self.via[self.via_offset[k]:self.via_offset[k + 1]].tolist()
+
+    def append(self, idx, origin, destination, intermediate):
+        self.index.append(idx)
+        self.source.append(origin)
+        self.sink.append(destination)
+        self.via.extend(intermediate)
+        self.via_offset.append(len(self.via))
+
+    def extend(self, other):
+        offset = len(self.via)
+        self.index.extend(other.index)
+        self.source.extend(other.source)
+        self.sink.extend(other.sink)
+        self.via.extend(other.via)
+        self.via_offset.extend([o + offset for o in other.via_offset[1:]])
+
+    def __iter__(self):
+        """yield (index, source, sink, via list) for all trips"""
+        for k in range(len(self)):
+            yield (self.index[k],) + self[k]
+
+    def select(self, indices):
+        """return the trips whose index is contained in the array indices"""
+        result = GeneratedTrips()
+        if len(self) == 0:
+            return result
+        keep = np.isin(np.frombuffer(self.index, dtype=np.int64), indices)
+        viaCount = np.diff(np.frombuffer(self.via_offset, dtype=np.int64))
+        result.index.frombytes(np.frombuffer(self.index, dtype=np.int64)[keep].tobytes())
+        result.source.frombytes(np.frombuffer(self.source, dtype=np.int32)[keep].tobytes())
+        result.sink.frombytes(np.frombuffer(self.sink, dtype=np.int32)[keep].tobytes())
+        result.via.frombytes(np.frombuffer(self.via, dtype=np.int32)[np.repeat(keep, viaCount)].tobytes())
+        result.via_offset.frombytes(np.cumsum(viaCount[keep]).tobytes())
+        return result
+
+
+class TripColumns:
+
+    """The written trips as columns for --columnar-output. The edges are kept as
+    indices into the EdgeTable until the columns are written"""
+
+    def __init__(self):
+        self.trips = GeneratedTrips()
+        self.ids = []
+        self.depart = array('d')
+        self.types = []
+        self.departPos = array('d')
+        self.arrivalPos = array('d')
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _position(attrs, key):
+        try:
+            return float(attrs[key])
+        except (KeyError, ValueError):
+            # missing or symbolic like "random"
+            return math.nan
+
+    def append(self, idx, label, depart, origin, destination, intermediate, attrs):
+        self.trips.append(idx, origin, destination, intermediate)
+        self.ids.append(label)
+        self.depart.append(depart)
+        self.types.append(attrs.get("type", ""))
+        self.departPos.append(self._position(attrs, "departPos"))
+        self.arrivalPos.append(self._position(attrs, "arrivalPos"))
+
+    def extend(self, other):
+        self.trips.extend(other.trips)
+        self.ids += other.ids
+        self.depart.extend(other.depart)
+        self.types += other.types
+        self.departPos.extend(other.departPos)
+        self.arrivalPos.extend(other.arrivalPos)
+
+    def select(self, indices):
+        """return the rows whose trip index is contained in the array indices"""
+        result = TripColumns()
+        keep = np.isin(np.frombuffer(self.trips.index, dtype=np.int64), indices)
+        for k in np.flatnonzero(keep).tolist():
+            source, sink, via = self.trips[k]
+            result.trips.append(self.trips.index[k], source, sink, via)
+            result.ids.append(self.ids[k])
+            result.depart.append(self.depart[k])
+            result.types.append(self.types[k])
+            result.departPos.append(self.departPos[k])
+            result.arrivalPos.append(self.arrivalPos[k])
+        return result
+
+    def write(self, fname, edges):
+        """write a .parquet file with the edges as dictionary encoded strings or an
+        uncompressed .npz file with the edge ids in 'edges', from, to and via as
+        indices into it and the via edges of row k as via[via_offset[k]:via_offset[k + 1]]"""
+        source = np.frombuffer(self.trips.source, dtype=np.int32)
+        sink = np.frombuffer(self.trips.sink, dtype=np.int32)
+        viaOffset = np.frombuffer(self.trips.via_offset, dtype=np.int64)
+        via = np.frombuffer(self.trips.via, dtype=np.int32)
+        if fname.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            edgeIDs = pa.array(edges.ids, type=pa.string())
+
+            def edgeColumn(indices):
+                return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()), edgeIDs)
+
+            table = pa.table({
+                "id": pa.array(self.ids, type=pa.string()),
+                "depart": pa.array(np.frombuffer(self.depart, dtype=np.float64)),
+                "from": edgeColumn(source),
+                "to": edgeColumn(sink),
+                "via": pa.ListArray.from_arrays(pa.array(viaOffset.astype(np.int32)), edgeColumn(via)),
+                "type": pa.array(self.types, type=pa.string()).dictionary_encode(),
+                "departPos": pa.array(np.frombuffer(self.departPos, dtype=np.float64)),
+                "arrivalPos": pa.array(np.frombuffer(self.arrivalPos, dtype=np.float64)),
+            })
+            pq.write_table(table, fname)
+        else:
+            columns = {
+                "id": np.array(self.ids, dtype=str),
+                "depart": np.frombuffer(self.depart, dtype=np.float64),
+                "edges": np.array(edges.ids, dtype=str),
+                "from": source,
+                "to": sink,
+                "via_offset": viaOffset,
+                "via": via,
+                "type": np.array(self.types, dtype=str),
+                "departPos": np.frombuffer(self.departPos, dtype=np.float64),
+                "arrivalPos": np.frombuffer(self.arrivalPos, dtype=np.float64),
+            }
+            with open(fname, "wb") as f:
+                np.savez(f, **columns)
+
+
+def parseTripIndices(fname, options):
+    """return the indices of the trips in fname as an array (ids which do not
+    consist of --prefix and an integer are skipped)"""
+    prefixLength = len(options.tripprefix)
+    indices = array('q')
+    for trip in sumolib.xml.parse_fast(fname, getElement(options), ['id']):
+        try:
+            indices.append(int(trip.id[prefixLength:]))
+        except ValueError:
+            pass
+    return np.frombuffer(indices, dtype=np.int64)
+
+
+class TripWriter:
+
+    """writes the XML elements for generated trips, persons and flows to fouttrips"""
+
+    def __init__(self, options, fouttrips, tripattrs, personattrs, otherattrs):
+        self.options = options
+        self.edges = options.edgeTable
+        self.fouttrips = fouttrips
+        self.tripattrs = tripattrs
+        self.personattrs = personattrs
+        self.otherattrs = otherattrs
+        self.generatedTrips = GeneratedTrips()
+        self.random = random
+        self.interval = None
+        self.intervalCount = 0
+        self.columns = TripColumns() if options.columnarOutput else None
+
+    def start_interval(self, interval, rand):
+        """label the following trips by their number within the interval and draw
+        their positions and stops from rand (for --seed-streams)"""
+        self.interval = interval
+        self.intervalCount = 0
+        self.random = rand
+
+    def generate_attributes(self, idx, departureTime, arrivalTime, origin, destination, intermediate):
+        options = self.options
+        edges = self.edges
+        if self.interval is None:
+            label = "%s%s" % (options.tripprefix, idx)
+        else:
+            label = "%s%s.%s" % (options.tripprefix, self.interval, self.intervalCount)
+            self.intervalCount += 1
         if options.pedestrians:
             combined_attrs = ""
         else:
-            combined_attrs = tripattrs
+            combined_attrs = self.tripattrs
         arrivalPos = ""
         if options.randomDepartPos:
-            randomPosition = samplePosition(origin)
+            randomPosition = samplePosition(edges.length[origin], self.random)
             combined_attrs += ' departPos="%.2f"' % randomPosition
         if options.randomArrivalPos:
-            randomPosition = samplePosition(destination)
+            randomPosition = samplePosition(edges.length[destination], self.random)
             arrivalPos = ' arrivalPos="%.2f"' % randomPosition
             if not options.pedestrians:
                 combined_attrs += arrivalPos
-        if options.fringeattrs and origin.is_fringe(
-                origin._incoming, checkJunctions=options.fringeJunctions):
+        if options.fringeattrs and edges.is_fringe(
+                origin, "_incoming", checkJunctions=options.fringeJunctions):
             combined_attrs += " " + options.fringeattrs
         if options.junctionTaz:
-            attrFrom = ' fromJunction="%s"' % origin.getFromNode().getID()
-            attrTo = ' toJunction="%s"' % destination.getToNode().getID()
+            attrFrom = ' fromJunction="%s"' % edges.node_ids[edges.from_node[origin]]
+            attrTo = ' toJunction="%s"' % edges.node_ids[edges.to_node[destination]]
         else:
-            attrFrom = ' from="%s"' % origin.getID()
-            attrTo = ' to="%s"' % destination.getID()
+            attrFrom = ' from="%s"' % edges.ids[origin]
+            attrTo = ' to="%s"' % edges.ids[destination]
         if options.fromStops:
-            attrFrom = ' %s="%s"' % random.choice(options.edgeFromStops[origin.getID()])
+            attrFrom = ' %s="%s"' % self.random.choice(options.edgeFromStops[edges.ids[origin]])
         if options.toStops:
-            attrTo = ' %s="%s"' % random.choice(options.edgeToStops[destination.getID()])
+            attrTo = ' %s="%s"' % self.random.choice(options.edgeToStops[edges.ids[destination]])
         via = ""
         if intermediate:
             via = ' via="%s" ' % ' '.join(
-                [e.getID() for e in intermediate])
-            if options.validate:
-                vias[label] = via
+                [edges.ids[e] for e in intermediate])
         return label, combined_attrs, attrFrom, attrTo, via, arrivalPos
 
-    def generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate, options):
+    def generate_one_plan(self, combined_attrs, attrFrom, attrTo, arrivalPos, intermediate):
+        options = self.options
+        fouttrips = self.fouttrips
         element = "walk"
-        attrs = otherattrs + arrivalPos
+        attrs = self.otherattrs + arrivalPos
         if options.fromStops:
             fouttrips.write('        <stop%s duration="0"/>\n' % attrFrom)
             attrFrom = ''
@@ -783,22 +2318,24 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
             element = "personTrip"
         elif options.personrides:
             element = "ride"
-            attrs = ' lines="%s%s"' % (options.personrides, otherattrs)
+            attrs = ' lines="%s%s"' % (options.personrides, self.otherattrs)
         if intermediate:
-            fouttrips.write('        <%s%s to="%s"%s/>\n' % (element, attrFrom, intermediate[0].getID(), attrs))
+            fouttrips.write('        <%s%s to="%s"%s/>\n' % (element, attrFrom, self.edges.ids[intermediate[0]], attrs))
             for edge in intermediate[1:]:
-                fouttrips.write('        <%s to="%s"%s/>\n' % (element, edge.getID(), attrs))
+                fouttrips.write('        <%s to="%s"%s/>\n' % (element, self.edges.ids[edge], attrs))
             fouttrips.write('        <%s%s%s/>\n' % (element, attrTo, attrs))
         else:
             fouttrips.write('        <%s%s%s%s/>\n' % (element, attrFrom, attrTo, attrs))
 
-    def generate_one_person(label, combined_attrs, attrFrom, attrTo, arrivalPos, departureTime, intermediate, options):
-        fouttrips.write(
-            '    <person id="%s" depart="%.2f"%s%s>\n' % (label, departureTime, personattrs, combined_attrs))
-        generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate, options)
-        fouttrips.write('    </person>\n')
+    def generate_one_person(self, label, combined_attrs, attrFrom, attrTo, arrivalPos, departureTime, intermediate):
+        self.fouttrips.write(
+            '    <person id="%s" depart="%.2f"%s%s>\n' % (label, departureTime, self.personattrs, combined_attrs))
+        self.generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate)
+        self.fouttrips.write('    </person>\n')
 
-    def generate_one_flow(label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx):
+    def generate_one_flow(self, label, combined_attrs, departureTime, arrivalTime, period, timeIdx):
+        options = self.options
+        fouttrips = self.fouttrips
         if len(options.period) > 1:
             label = label + "#%s" % timeIdx
         if options.binomial:
@@ -813,8 +2350,10 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
             fouttrips.write(('    <flow id="%s" begin="%s" end="%s" period="%s"%s/>\n') % (
                 label, departureTime, arrivalTime, intIfPossible(period * options.flows), combined_attrs))
 
-    def generate_one_personflow(label, combined_attrs, attrFrom, attrTo, arrivalPos,
-                                departureTime, arrivalTime, period, options, timeIdx):
+    def generate_one_personflow(self, label, combined_attrs, attrFrom, attrTo, arrivalPos,
+                                departureTime, arrivalTime, period, timeIdx, intermediate):
+        options = self.options
+        fouttrips = self.fouttrips
         if len(options.period) > 1:
             label = label + "#%s" % timeIdx
         if options.binomial:
@@ -822,7 +2361,7 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
                 fouttrips.write(('    <personFlow id="%s#%s" begin="%s" end="%s" probability="%.2f"%s>\n') % (
                     label, j, departureTime, arrivalTime, 1.0 / period / options.binomial,
                     combined_attrs))
-                generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate, options)
+                self.generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate)
                 fouttrips.write('    </personFlow>\n')
         else:
             if options.poisson:
@@ -831,26 +2370,31 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
             else:
                 fouttrips.write(('    <personFlow id="%s" begin="%s" end="%s" period="%s"%s>\n') % (
                     label, departureTime, arrivalTime, intIfPossible(period * options.flows), combined_attrs))
-            generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate, options)
+            self.generate_one_plan(combined_attrs, attrFrom, attrTo, arrivalPos, intermediate)
             fouttrips.write('    </personFlow>\n')
 
-    def generate_one_trip(label, combined_attrs, departureTime):
-        fouttrips.write('    <trip id="%s" depart="%.2f"%s/>\n' % (
+    def generate_one_trip(self, label, combined_attrs, departureTime):
+        self.fouttrips.write('    <trip id="%s" depart="%.2f"%s/>\n' % (
             label, departureTime, combined_attrs))
 
-    def generate_one(idx, departureTime, arrivalTime, period, origin, destination, intermediate, timeIdx=None):
+    def generate_one(self, idx, departureTime, arrivalTime, period, origin, destination, intermediate, timeIdx=None):
+        options = self.options
         try:
-            label, combined_attrs, attrFrom, attrTo, via, arrivalPos = generate_attributes(
-                idx, departureTime, arrivalTime, origin, destination, intermediate, options)
-            generatedTrips.append((label, origin, destination, intermediate))
+            label, combined_attrs, attrFrom, attrTo, via, arrivalPos = self.generate_attributes(
+                idx, departureTime, arrivalTime, origin, destination, intermediate)
+            self.generatedTrips.append(idx, origin, destination, intermediate)
+            if self.columns is not None:
+                attrs = (self.personattrs if options.pedestrians else "") + combined_attrs + arrivalPos
+                self.columns.append(idx, label, departureTime, origin, destination, intermediate,
+                                    dict(ATTRIBUTE_RE.findall(attrs)))
 
             if options.pedestrians:
                 if options.flows > 0:
-                    generate_one_personflow(label, combined_attrs, attrFrom, attrTo, arrivalPos,
-                                            departureTime, arrivalTime, period, options, timeIdx)
+                    self.generate_one_personflow(label, combined_attrs, attrFrom, attrTo, arrivalPos,
+                                                 departureTime, arrivalTime, period, timeIdx, intermediate)
                 else:
-                    generate_one_person(label, combined_attrs, attrFrom, attrTo, arrivalPos,
-                                        departureTime, intermediate, options)
+                    self.generate_one_person(label, combined_attrs, attrFrom, attrTo, arrivalPos,
+                                             departureTime, intermediate)
             else:
                 if options.jtrrouter:
                     attrTo = ''
@@ -858,110 +2402,442 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
                 combined_attrs = attrFrom + attrTo + via + combined_attrs
 
                 if options.flows > 0:
-                    generate_one_flow(label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx)
+                    self.generate_one_flow(label, combined_attrs, departureTime, arrivalTime, period, timeIdx)
                 else:
-                    generate_one_trip(label, combined_attrs, departureTime)
+                    self.generate_one_trip(label, combined_attrs, departureTime)
 
         except Exception as exc:
             print(exc, file=sys.stderr)
 
         return idx + 1
 
-    with openz(options.tripfile, 'w') as fouttrips:
-        sumolib.writeXMLHeader(fouttrips, "$Id$", "routes", options=options)
-        if options.vehicle_class:
-            vTypeDef = '    <vType id="%s" vClass="%s"%s/>\n' % (
-                options.vtypeID, options.vehicle_class, vtypeattrs)
-            if options.vtypeout:
-                # ensure that trip output does not contain types, file may be
-                # overwritten by later call to duarouter
-                if options.additional is None:
-                    options.additional = options.vtypeout
-                elif options.vtypeout not in options.additional:
-                    options.additional = options.additional + "," + options.vtypeout
-                with openz(options.vtypeout, 'w') as fouttype:
-                    sumolib.writeXMLHeader(fouttype, "$Id$", "additional", options=options)
-                    fouttype.write(vTypeDef)
-                    fouttype.write("</additional>\n")
-            else:
-                fouttrips.write(vTypeDef)
-            tripattrs += ' type="%s"' % options.vtypeID
-            personattrs += ' type="%s"' % options.vtypeID
 
-        if trip_generator:
-            if options.flows == 0:
-                for i in range(len(times)-1):
-                    time = departureTime = parseTime(times[i])
-                    arrivalTime = parseTime(times[i+1])
-                    period = options.period[i]
-                    if rerunFactor is not None:
-                        period /= rerunFactor
-                    if period == 0.0:
-                        continue
-                    if options.binomial is None:
-                        departures = []
-                        if options.randomDepart:
-                            subsecond = math.fmod(period, 1)
-                            while time < arrivalTime:
-                                rTime = random.randrange(int(departureTime), int(arrivalTime))
-                                time += period
-                                if subsecond != 0:
-                                    # allow all multiples of subsecond to appear
-                                    rSubSecond = math.fmod(
-                                        subsecond * random.randrange(int(departureTime), int(arrivalTime)), 1)
-                                    rTime = min(arrivalTime, rTime + rSubSecond)
-                                departures.append(rTime)
-                            departures.sort()
-                        else:
-                            # generate with constant spacing
-                            while departureTime < arrivalTime:
-                                departures.append(departureTime)
-                                departureTime += period
-
-                        for time in departures:
-                            try:
-                                origin, destination, intermediate = generate_origin_destination(trip_generator, options)
-                                idx = generate_one(idx, time, arrivalTime, period, origin, destination, intermediate)
-                            except Exception as exc:
-                                print(exc, file=sys.stderr)
-                    else:
-                        time = departureTime
-                        while time < arrivalTime:
-                            # draw n times from a Bernoulli distribution
-                            # for an average arrival rate of 1 / period
-                            prob = 1.0 / period / options.binomial
-                            for _ in range(options.binomial):
-                                if random.random() < prob:
-                                    try:
-                                        origin, destination, intermediate = generate_origin_destination(
-                                            trip_generator, options)
-                                        idx = generate_one(idx, time, arrivalTime, period,
-                                                           origin, destination, intermediate)
-                                    except Exception as exc:
-                                        print(exc, file=sys.stderr)
-                            time += 1.0
+def sampleDepartures(rng, options, departureTime, arrivalTime, period):
+    """return the sorted departure times of one interval for --random-depart or
+    --binomial, drawn with the same distribution as iterDepartures"""
+    if options.binomial is None:
+        n = int(math.ceil((arrivalTime - departureTime) / period))
+        departures = rng.integers(int(departureTime), int(arrivalTime), n)
+        subsecond = math.fmod(period, 1)
+        if subsecond != 0:
+            # allow all multiples of subsecond to appear
+            offsets = np.fmod(subsecond * rng.integers(int(departureTime), int(arrivalTime), n), 1)
+            departures = np.minimum(arrivalTime, departures + offsets)
+        departures.sort()
+    else:
+        seconds = departureTime + np.arange(int(math.ceil(arrivalTime - departureTime)))
+        prob = min(1.0, 1.0 / period / options.binomial)
+        departures = np.repeat(seconds, rng.binomial(options.binomial, prob, len(seconds)))
+    return departures.tolist()
+
+
+def iterDepartures(options, times, rerunFactor=None, intervals=None, rand=random):
+    """yield (departureTime, arrivalTime, period) for every trip of the non-flow output
+    (only for the given interval indices if intervals is set), drawing from rand.
+    The random draws happen lazily so they interleave with the trip sampling of the caller"""
+    vectorized = options.depart_sampler == "vectorized" and (options.randomDepart or options.binomial is not None)
+    rng = np.random.default_rng(rand.getrandbits(64)) if vectorized else None
+    for i in (range(len(times)-1) if intervals is None else intervals):
+        time = departureTime = parseTime(times[i])
+        arrivalTime = parseTime(times[i+1])
+        period = options.period[i]
+        if rerunFactor is not None:
+            period /= rerunFactor
+        if period == 0.0:
+            continue
+        if vectorized:
+            for time in sampleDepartures(rng, options, departureTime, arrivalTime, period):
+                yield time, arrivalTime, period
+        elif options.binomial is None:
+            departures = []
+            if options.randomDepart:
+                subsecond = math.fmod(period, 1)
+                while time < arrivalTime:
+                    rTime = rand.randrange(int(departureTime), int(arrivalTime))
+                    time += period
+                    if subsecond != 0:
+                        # allow all multiples of subsecond to appear
+                        rSubSecond = math.fmod(
+                            subsecond * rand.randrange(int(departureTime), int(arrivalTime)), 1)
+                        rTime = min(arrivalTime, rTime + rSubSecond)
+                    departures.append(rTime)
+                departures.sort()
             else:
+                # generate with constant spacing
+                while departureTime < arrivalTime:
+                    departures.append(departureTime)
+                    departureTime += period
+
+            for time in departures:
+                yield time, arrivalTime, period
+        else:
+            time = departureTime
+            while time < arrivalTime:
+                # draw n times from a Bernoulli distribution
+                # for an average arrival rate of 1 / period
+                prob = 1.0 / period / options.binomial
+                for _ in range(options.binomial):
+                    if rand.random() < prob:
+                        yield time, arrivalTime, period
+                time += 1.0
+
+
+def deriveSeed(seed, shard):
+    """return a reproducible seed for the given shard"""
+    return int(hashlib.sha1(("%s:%s" % (seed, shard)).encode("utf8")).hexdigest()[:16], 16)
+
+
+class SeedStreams:
+
+    """The random streams of one interval for --seed-streams. Each stream depends
+    only on the seed, the interval index and the stream name"""
+
+    NAMES = ("source", "sink", "via", "depart", "positions")
+
+    def __init__(self, seed, interval):
+        for name in self.NAMES:
+            setattr(self, name, random.Random(deriveSeed(seed, "%s.%s" % (interval, name))))
+
+
+def iterStreamDepartures(options, trip_generator, writer, times, intervals, seed):
+    """yield the departures of the given intervals like iterDepartures after switching
+    trip_generator and writer to the random streams of each interval"""
+    for i in intervals:
+        streams = SeedStreams(seed, i)
+        trip_generator.start_interval(streams)
+        writer.start_interval(i, streams.positions)
+        for departure in iterDepartures(options, times, None, [i], streams.depart):
+            yield departure
+
+
+def writeTrips(options, trip_generator, writer, departures, idx, pipeline=None):
+    """generate and write the trips for the given departures. Returns the next free index"""
+    for time, arrivalTime, period in departures:
+        try:
+            origin, destination, intermediate = generate_origin_destination(trip_generator, options, time)
+            idx = writer.generate_one(idx, time, arrivalTime, period, origin, destination, intermediate)
+            if pipeline is not None:
+                pipeline.trip_done()
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+    return idx
+
+
+# state of a worker process for --jobs, inherited from the parent when forking
+_shardState = None
+
+
+def _initShardWorker(options, trip_generator, writerAttrs):
+    global _shardState
+    _shardState = (options, trip_generator, writerAttrs)
+
+
+def _generateShard(shard):
+    options, trip_generator, writerAttrs = _shardState
+    idx, seed, departures = shard
+    RUN_PROFILE.counts.clear()
+    random.seed(seed)
+    trip_generator.start_shard(idx)
+    out = io.StringIO()
+    writer = TripWriter(options, out, *writerAttrs)
+    for time, arrivalTime, period in departures:
+        try:
+            origin, destination, intermediate = generate_origin_destination(trip_generator, options, time)
+            writer.generate_one(idx, time, arrivalTime, period, origin, destination, intermediate)
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+        # ids are fixed by the position in the schedule
+        idx += 1
+    return out.getvalue(), writer.generatedTrips, writer.columns, dict(RUN_PROFILE.counts)
+
+
+def writeShardedTrips(options, trip_generator, writer, departures, idx, pipeline=None):
+    """generate the trips for the given departures in options.jobs worker
+    processes and write them in departure order. Returns the next free index"""
+    if not departures:
+        return idx
+    nShards = min(options.jobs, len(departures))
+    # draw the base seed from the global stream (seeded by --seed) so that every call,
+    # e.g. the rerun of --validate, gets new shard seeds while the run stays reproducible
+    seed = random.getrandbits(64)
+    bounds = [len(departures) * k // nShards for k in range(nShards + 1)]
+    shards = [(idx + bounds[k], deriveSeed(seed, k), departures[bounds[k]:bounds[k + 1]]) for k in range(nShards)]
+    writer.fouttrips.flush()
+    pool = multiprocessing.get_context("fork").Pool(
+        nShards, _initShardWorker, (options, trip_generator, (writer.tripattrs, writer.personattrs, writer.otherattrs)))
+    try:
+        for body, generatedTrips, columns, counts in pool.imap(_generateShard, shards):
+            writer.fouttrips.write(body)
+            writer.generatedTrips.extend(generatedTrips)
+            if columns is not None:
+                writer.columns.extend(columns)
+            RUN_PROFILE.merge_counts(counts)
+            if pipeline is not None:
+                pipeline.trip_done(len(generatedTrips))
+    finally:
+        pool.close()
+        pool.join()
+    return idx + len(departures)
+
+
+class TeeOutput:
+
+    """passes all writes on to several outputs"""
+
+    def __init__(self, *outputs):
+        self.outputs = outputs
+
+    def write(self, text):
+        for output in self.outputs:
+            output.write(text)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+
+
+class RoutingPipeline:
+
+    """Collects the written trips in chunks of consecutive departures and routes each
+    finished chunk with duarouter while the next chunks are generated. At the end the
+    routed chunks are joined into options.routefile in departure order"""
+
+    def __init__(self, options, vTypeDef):
+        self.options = options
+        self.header = "<routes>\n" + (vTypeDef or "")
+        self.tmpDir = tempfile.mkdtemp(prefix="randomTrips",
+                                       dir=os.path.dirname(os.path.abspath(options.routefile)))
+        self.buffer = io.StringIO()
+        self.nTrips = 0
+        self.chunks = []  # (route file, error log)
+        self.running = deque()
+
+    def write(self, text):
+        self.buffer.write(text)
+
+    def flush(self):
+        pass
+
+    def trip_done(self, n=1):
+        self.nTrips += n
+        if self.nTrips >= self.options.routingChunkSize:
+            self._route_chunk()
+
+    def _route_chunk(self):
+        if self.nTrips == 0:
+            return
+        options = self.options
+        prefix = os.path.join(self.tmpDir, "chunk%s" % len(self.chunks))
+        with io.open(prefix + ".trips.xml", "w", encoding="utf8") as f:
+            f.write(self.header)
+            f.write(self.buffer.getvalue())
+            f.write("</routes>\n")
+        self.buffer = io.StringIO()
+        self.nTrips = 0
+        args = getRouterArgs(options, prefix + ".trips.xml")[0]
+        if options.vtypeout is not None:
+            # the types are written by the generation, not by every chunk
+            i = args.index('--vtype-output')
+            del args[i:i + 2]
+        if options.errorlog:
+            args[args.index('--error-log') + 1] = prefix + ".log"
+        args += ['-o', prefix + ".rou.xml"]
+        while len(self.running) >= options.routingJobs:
+            self._wait()
+        if options.verbose:
+            print("calling", " ".join(args))
+            sys.stdout.flush()
+        self.running.append(subprocess.Popen(args))
+        self.chunks.append((prefix + ".rou.xml", prefix + ".log"))
+        RUN_PROFILE.count("routing chunks")
+
+    def _wait(self):
+        with RUN_PROFILE.phase("router wait"):
+            self.running.popleft().wait()
+
+    def finish(self):
+        """route the last chunk and write the joined route file"""
+        self._route_chunk()
+        while self.running:
+            self._wait()
+        try:
+            self._join()
+        finally:
+            shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def _join(self):
+        options = self.options
+        vTypes = set()
+        with io.open(options.routefile, "w", encoding="utf8") as out:
+            sumolib.writeXMLHeader(out, "$Id$", "routes", options=options)
+            for routeFile, errorLog in self.chunks:
+                if not os.path.isfile(routeFile):
+                    print("Warning: Routing of chunk '%s' failed." % routeFile, file=sys.stderr)
+                    continue
+                inRoutes = False
+                inVType = False
+                writeVType = True
+                with io.open(routeFile, encoding="utf8") as f:
+                    for line in f:
+                        stripped = line.strip()
+                        if not inRoutes:
+                            # skip the xml header and the configuration comment
+                            inRoutes = stripped.startswith("<routes")
+                        elif inVType:
+                            if writeVType:
+                                out.write(line)
+                            inVType = not stripped.startswith("</vType")
+                        elif stripped.startswith("<vType"):
+                            # keep the first definition of each type
+                            vTypeID = dict(ATTRIBUTE_RE.findall(stripped)).get("id")
+                            writeVType = vTypeID not in vTypes
+                            vTypes.add(vTypeID)
+                            if writeVType:
+                                out.write(line)
+                            inVType = not stripped.endswith("/>")
+                        elif not stripped.startswith("</routes"):
+                            out.write(line)
+            out.write("</routes>\n")
+        if options.errorlog:
+            with io.open(options.errorlog, "w", encoding="utf8") as log:
+                for routeFile, errorLog in self.chunks:
+                    if os.path.isfile(errorLog):
+                        with io.open(errorLog, encoding="utf8") as f:
+                            shutil.copyfileobj(f, log)
+
+
+class ODCache:
+
+    """Origin-destination pairs (including via edges) which are known to be valid
+    or invalid for routing. The pairs are stored as JSON and are only reused for
+    the same state of the network and the same routing relevant options"""
+
+    def __init__(self, fname, options):
+        self.fname = fname
+        self.edges = options.edgeTable
+        self.net = getNetFingerprint(options.netfile)
+        self.context = "|".join(map(str, (
+            getElement(options), options.edge_permission, options.vehicle_class, options.junctionTaz,
+            options.fromStops, options.toStops, options.tripattrs, options.additional)))
+        self.contexts = {}
+        if fname and os.path.isfile(fname):
+            try:
+                with io.open(fname, encoding="utf8") as f:
+                    data = json.load(f)
+                if data.get("net") == self.net:
+                    self.contexts = data["contexts"]
+            except (IOError, OSError, ValueError, KeyError) as e:
+                print("Warning: Could not load validation cache (%s), starting empty." % e, file=sys.stderr)
+        entry = self.contexts.get(self.context, {})
+        self.valid = set(entry.get("valid", ()))
+        self.invalid = set(entry.get("invalid", ()))
+
+    def key(self, origin, destination, intermediate):
+        return " ".join([self.edges.ids[e] for e in [origin, destination] + list(intermediate)])
+
+    def get(self, key):
+        """return True or False for known pairs and None otherwise"""
+        if key in self.valid:
+            return True
+        if key in self.invalid:
+            return False
+        return None
+
+    def add(self, key, valid):
+        (self.valid if valid else self.invalid).add(key)
+
+    def save(self):
+        if not self.fname:
+            return
+        self.contexts[self.context] = {"valid": sorted(self.valid), "invalid": sorted(self.invalid)}
+        tmp = self.fname + ".tmp"
+        with io.open(tmp, "w", encoding="utf8") as f:
+            json.dump({"net": self.net, "contexts": self.contexts}, f)
+        os.replace(tmp, self.fname)
+
+
+def findValidTrips(options, trip_generator, departures, vTypeDef, writerAttrs):
+    """return a valid (origin, destination, intermediate) triple or None for each
+    departure. Only pairs which are not in the validation cache are routed and
+    further candidates are drawn for the open departures until all are filled"""
+    cache = ODCache(options.validationCache, options)
+    probeFile = options.tripfile + ".probe.xml"
+    probeOut = options.tripfile + ".probe.out.xml"
+    duargs = getRouterArgs(options, probeFile)[0]
+    begin = parseTime(options.begin)
+    trips = [None] * len(departures)
+    pending = list(range(len(departures)))
+    successRate = 1.
+    while pending:
+        RUN_PROFILE.count("validation rounds")
+        perDeparture = min(options.maxtries, int(math.ceil(1.2 / successRate)))
+        candidates = []  # (departure index, trip, key)
+        for slot in pending:
+            for _ in range(perDeparture):
                 try:
-                    origins_destinations = [generate_origin_destination(
-                        trip_generator, options) for _ in range(options.flows)]
-                    for i in range(len(times)-1):
-                        for j in range(options.flows):
-                            departureTime = times[i]
-                            arrivalTime = times[i+1]
-                            period = options.period[i]
-                            if rerunFactor is not None:
-                                period /= rerunFactor
-                            if period == 0.0:
-                                continue
-                            origin, destination, intermediate = origins_destinations[j]
-                            generate_one(j, departureTime, arrivalTime, period, origin, destination, intermediate, i)
+                    trip = generate_origin_destination(trip_generator, options, departures[slot][0])
                 except Exception as exc:
                     print(exc, file=sys.stderr)
+                    continue
+                candidates.append((slot, trip, cache.key(*trip)))
+        unknown = dict([(key, trip) for slot, trip, key in candidates if cache.get(key) is None])
+        if unknown:
+            # route each unknown pair once
+            with BufferedOutput(probeFile) as fprobe:
+                sumolib.writeXMLHeader(fprobe, "$Id$", "routes", options=options)
+                if vTypeDef:
+                    fprobe.write(vTypeDef)
+                writer = TripWriter(options, fprobe, *writerAttrs)
+                for idx, trip in enumerate(unknown.values()):
+                    writer.generate_one(idx, begin, begin, 1, *trip)
+                fprobe.write("</routes>\n")
+            args = duargs + ['-o', probeOut, '--write-trips']
+            if options.junctionTaz:
+                args += ['--write-trips.junctions']
+            callRouter(args, options)
+            validIndices = set(parseTripIndices(probeOut, options).tolist())
+            for idx, origin, destination, intermediate in writer.generatedTrips:
+                cache.add(cache.key(origin, destination, intermediate), idx in validIndices)
+            for fname in (probeFile, probeOut):
+                if os.path.exists(fname):
+                    os.remove(fname)
+        nValid = 0
+        for slot, trip, key in candidates:
+            if cache.get(key):
+                nValid += 1
+                if trips[slot] is None:
+                    trips[slot] = trip
+        pending = [slot for slot in pending if trips[slot] is None]
+        successRate = nValid / max(1, len(candidates))
+        found = len(departures) - len(pending)
+        if options.verbose:
+            print("Validation: %s of %s candidates are valid (%s routed), found %s of %s %ss." % (
+                nValid, len(candidates), len(unknown), found, len(departures), getElement(options)))
+        if pending and (successRate == 0 or successRate < options.minSuccessRate):
+            print("Warning: Only %s out of %s requested %ss passed validation. "
+                  "Set option --error-log for more details on the failure. "
+                  "Set option --min-success-rate to find more valid trips." %
+                  (found, len(departures), getElement(options)), file=sys.stderr)
+            break
+    try:
+        cache.save()
+    except (IOError, OSError) as e:
+        print("Warning: Could not write validation cache (%s)." % e, file=sys.stderr)
+    return trips
 
-        fouttrips.write("</routes>\n")
 
-    # call duarouter for routes or validated trips
-    args = ['-n', options.netfile, '-r', options.tripfile, '--ignore-errors',
+def callRouter(args, options):
+    if options.verbose:
+        print("calling", " ".join(args))
+        sys.stdout.flush()
+    with RUN_PROFILE.phase("router"):
+        subprocess.call(args)
+    sys.stdout.flush()
+
+
+def getRouterArgs(options, tripfile):
+    """return the duarouter and marouter calls for routing tripfile"""
+    args = ['-n', options.netfile, '-r', tripfile, '--ignore-errors',
             '--begin', str(options.begin), '--end', str(options.end),
             '--no-warnings',
             '--no-step-log']
@@ -1001,15 +2877,218 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
                 else:
                     raise ValueError("The argument '%s' has already been passed without the %s prefix." % (
                                      option[0], router))
+    return duargs, maargs
+
+
+def getIntervalTimes(options):
+    """return the boundaries of the intervals of options.period"""
+    if getattr(options, "intervalTimes", None):
+        return options.intervalTimes
+    time_delta = (parseTime(options.end) - parseTime(options.begin)) / len(options.period)
+    times = [parseTime(options.begin) + i * time_delta for i in range(len(options.period) + 1)]
+    return list(map(intIfPossible, times))
+
+
+def iterTrips(options, trip_generator=None):
+    """Yield the trips for options (as returned by get_options) lazily in order of
+    departure as TripRecord tuples instead of writing a trip file. For a given seed
+    these are the trips of the trip file written by main. A vType given by
+    --vehicle-class is referenced in the attributes but must be defined by the caller.
+    Validation and routing options are ignored"""
+    if options.flows > 0 or options.pedestrians:
+        raise ValueError("Only vehicle trips can be generated as a stream.")
+    if trip_generator is None:
+        trip_generator = prepareTripGenerator(options)
+        if trip_generator is None:
+            return
+    vtypeattrs, tripattrs, personattrs, otherattrs = split_trip_attributes(
+        options.tripattrs, options.pedestrians, options.vehicle_class, options.verbose)
+    if options.vehicle_class:
+        tripattrs += ' type="%s"' % options.vtypeID
+    edges = options.edgeTable
+    writer = TripWriter(options, None, tripattrs, personattrs, otherattrs)
+    times = getIntervalTimes(options)
+    if options.seedStreams:
+        seed = random.getrandbits(64) if options.random else options.seed
+        departures = iterStreamDepartures(options, trip_generator, writer, times, range(len(times) - 1), seed)
+    else:
+        departures = iterDepartures(options, times, None)
+    idx = 0
+    for time, arrivalTime, period in departures:
+        try:
+            origin, destination, intermediate = generate_origin_destination(trip_generator, options, time)
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            continue
+        label, combined_attrs, attrFrom, attrTo, via, arrivalPos = writer.generate_attributes(
+            idx, time, arrivalTime, origin, destination, intermediate)
+        idx += 1
+        yield TripRecord(label, time, edges.ids[origin], edges.ids[destination],
+                         tuple([edges.ids[e] for e in intermediate]), dict(ATTRIBUTE_RE.findall(combined_attrs)))
+
+
+def regenerateInterval(options, trip_generator):
+    """replace the trips of interval options.regenerateInterval in the trip file written
+    with --seed-streams"""
+    times = getIntervalTimes(options)
+    interval = options.regenerateInterval
+    if not 0 <= interval < len(times) - 1:
+        raise ValueError("Interval %s does not exist, there are %s intervals." % (interval, len(times) - 1))
+    _, tripattrs, personattrs, otherattrs = split_trip_attributes(
+        options.tripattrs, options.pedestrians, options.vehicle_class, options.verbose)
+    if options.vehicle_class:
+        tripattrs += ' type="%s"' % options.vtypeID
+        personattrs += ' type="%s"' % options.vtypeID
+    out = io.StringIO()
+    writer = TripWriter(options, out, tripattrs, personattrs, otherattrs)
+    if trip_generator:
+        departures = iterStreamDepartures(options, trip_generator, writer, times, [interval], options.seed)
+        writeTrips(options, trip_generator, writer, departures, 0)
+
+    # the top level elements of the trip file start with 4 spaces, their ids with the interval
+    elementRE = re.compile(r'    <\w+ id="%s(\d+)\.\d+"' % re.escape(options.tripprefix))
+    before = []
+    after = []
+    current = before
+    found = False
+    inRoutes = False
+    with openz(options.tripfile) as f:
+        for line in f:
+            if not inRoutes:
+                # the header is written again with the options of this run
+                inRoutes = line.startswith("<routes")
+                continue
+            match = elementRE.match(line)
+            if match:
+                found = True
+                lineInterval = int(match.group(1))
+                current = None if lineInterval == interval else (before if lineInterval < interval else after)
+            elif line.startswith("</routes"):
+                current = after
+            elif line.startswith("    <") and not line.startswith("    </"):
+                # any other top level element stays in place
+                current = after if current is after else before
+            if current is not None:
+                current.append(line)
+    if not found:
+        raise ValueError("The trip file '%s' was not written with --seed-streams." % options.tripfile)
+    # keep the .gz suffix so that the temporary file is compressed like the trip file
+    base, ext = (options.tripfile[:-3], ".gz") if options.tripfile.endswith(".gz") else (options.tripfile, "")
+    tmpTrips = base + ".tmp" + ext
+    with openz(tmpTrips, 'w') as f:
+        sumolib.writeXMLHeader(f, "$Id$", "routes", options=options)
+        f.writelines(before)
+        f.write(out.getvalue())
+        f.writelines(after)
+    os.remove(options.tripfile)  # on windows, rename does not overwrite
+    os.rename(tmpTrips, options.tripfile)
+    if options.verbose:
+        print("Regenerated %s trips of interval %s (%s-%s)." % (
+            len(writer.generatedTrips), interval, times[interval], times[interval + 1]))
+
+
+def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False):
+    idx = 0
+
+    vtypeattrs, tripattrs, personattrs, otherattrs = split_trip_attributes(
+        options.tripattrs, options.pedestrians, options.vehicle_class, options.verbose)
+
+    validatedTrips = []  # (origin, destination, intermediate)
+
+    times = getIntervalTimes(options)
 
-    if options.routefile and rerunFactor is None:
+    vTypeDef = None
+    begin = perf_counter()
+    with BufferedOutput(options.tripfile, compressLevel=options.compressLevel,
+                        threads=options.compressThreads) as fouttrips:
+        sumolib.writeXMLHeader(fouttrips, "$Id$", "routes", options=options)
+        if options.vehicle_class:
+            vTypeDef = '    <vType id="%s" vClass="%s"%s/>\n' % (
+                options.vtypeID, options.vehicle_class, vtypeattrs)
+            if options.vtypeout:
+                # ensure that trip output does not contain types, file may be
+                # overwritten by later call to duarouter
+                if options.additional is None:
+                    options.additional = options.vtypeout
+                elif options.vtypeout not in options.additional:
+                    options.additional = options.additional + "," + options.vtypeout
+                with openz(options.vtypeout, 'w') as fouttype:
+                    sumolib.writeXMLHeader(fouttype, "$Id$", "additional", options=options)
+                    fouttype.write(vTypeDef)
+                    fouttype.write("</additional>\n")
+                vTypeDef = None
+            else:
+                fouttrips.write(vTypeDef)
+            tripattrs += ' type="%s"' % options.vtypeID
+            personattrs += ' type="%s"' % options.vtypeID
+
+        pipeline = None
+        if options.routefile and options.routingChunkSize and rerunFactor is None:
+            pipeline = RoutingPipeline(options, vTypeDef)
+            writer = TripWriter(options, TeeOutput(fouttrips, pipeline), tripattrs, personattrs, otherattrs)
+        else:
+            writer = TripWriter(options, fouttrips, tripattrs, personattrs, otherattrs)
+        if trip_generator:
+            if options.flows == 0 and options.seedStreams:
+                seed = random.getrandbits(64) if options.random else options.seed
+                departures = iterStreamDepartures(options, trip_generator, writer, times, range(len(times) - 1), seed)
+                idx = writeTrips(options, trip_generator, writer, departures, idx, pipeline)
+            elif options.flows == 0:
+                departures = iterDepartures(options, times, rerunFactor)
+                incremental = options.validationCache or options.intervalOverrides
+                if options.validate and incremental and not skipValidation and rerunFactor is None:
+                    departures = list(departures)
+                    trips = findValidTrips(options, trip_generator, departures, vTypeDef,
+                                           (tripattrs, personattrs, otherattrs))
+                    # drop the departures without a valid trip
+                    departures = [d for d, trip in zip(departures, trips) if trip is not None]
+                    validatedTrips = [trip for trip in trips if trip is not None]
+                    if validatedTrips:
+                        trip_generator = CachedTripGenerator(validatedTrips)
+                    skipValidation = True
+                if options.jobs > 1:
+                    idx = writeShardedTrips(options, trip_generator, writer, list(departures), idx, pipeline)
+                else:
+                    idx = writeTrips(options, trip_generator, writer, departures, idx, pipeline)
+            else:
+                try:
+                    origins_destinations = None
+                    for i in range(len(times)-1):
+                        if origins_destinations is None or options.intervalOverrides:
+                            # with a demand profile each interval has its own flows
+                            origins_destinations = [generate_origin_destination(
+                                trip_generator, options, times[i]) for _ in range(options.flows)]
+                        for j in range(options.flows):
+                            departureTime = times[i]
+                            arrivalTime = times[i+1]
+                            period = options.period[i]
+                            if rerunFactor is not None:
+                                period /= rerunFactor
+                            if period == 0.0:
+                                continue
+                            origin, destination, intermediate = origins_destinations[j]
+                            writer.generate_one(j, departureTime, arrivalTime, period,
+                                                origin, destination, intermediate, i)
+                except Exception as exc:
+                    print(exc, file=sys.stderr)
+
+        fouttrips.write("</routes>\n")
+    generatedTrips = writer.generatedTrips
+    columns = writer.columns
+    RUN_PROFILE.add_time("trip generation", perf_counter() - begin)
+    RUN_PROFILE.count("trips written", len(generatedTrips))
+    if os.path.isfile(options.tripfile):
+        RUN_PROFILE.count("bytes written", os.path.getsize(options.tripfile))
+
+    # call duarouter for routes or validated trips
+    duargs, maargs = getRouterArgs(options, options.tripfile)
+
+    if pipeline is not None:
+        pipeline.finish()
+    elif options.routefile and rerunFactor is None:
         args2 = (maargs if options.marouter else duargs)[:]
         args2 += ['-o', options.routefile]
-        if options.verbose:
-            print("calling", " ".join(args2))
-            sys.stdout.flush()
-        subprocess.call(args2)
-        sys.stdout.flush()
+        callRouter(args2, options)
         sumolib.xml.insertOptionsHeader(options.routefile, options)
 
     if options.validate and not skipValidation:
@@ -1018,21 +3097,20 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
         args2 = duargs + ['-o', tmpTrips, '--write-trips']
         if options.junctionTaz:
             args2 += ['--write-trips.junctions']
-        if options.verbose:
-            print("calling", " ".join(args2))
-            sys.stdout.flush()
-        subprocess.call(args2)
-        sys.stdout.flush()
+        RUN_PROFILE.count("validation rounds")
+        callRouter(args2, options)
         os.remove(options.tripfile)  # on windows, rename does not overwrite
         os.rename(tmpTrips, options.tripfile)
         sumolib.xml.insertOptionsHeader(options.tripfile, options)
 
-        validLabels = set([t.id for t in sumolib.xml.parse_fast(options.tripfile, getElement(options), ['id'])])
-        validatedTrips = [(o, d, i) for (label, o, d, i) in generatedTrips if label in validLabels]
+        validIndices = parseTripIndices(options.tripfile, options)
+        validatedTrips = generatedTrips.select(validIndices)
+        if columns is not None:
+            columns = columns.select(validIndices)
 
         if rerunFactor is None:
             nRequested = idx - 1
-            nValid = len(validLabels)
+            nValid = len(validIndices)
             if nRequested > 0 and nValid < nRequested:
                 successRate = nValid / nRequested
                 if successRate < options.minSuccessRate:
@@ -1048,10 +3126,13 @@ def createTrips(options, trip_generator, rerunFactor=None, skipValidation=False)
                     # 1. call the current trip_generator again to generate more valid origin-destination pairs
                     validatedTrips2 = createTrips(options, trip_generator, 1.2 / successRate - 1)
                     # 2. reconfigure trip_generator to only output valid pairs
-                    trip_generator2 = CachedTripGenerator(validatedTrips + validatedTrips2)
+                    validatedTrips.extend(validatedTrips2)
+                    trip_generator2 = CachedTripGenerator(validatedTrips)
                     # 3. call trip_generator again to output the desired number of trips
                     return createTrips(options, trip_generator2, skipValidation=True)
 
+    if columns is not None and rerunFactor is None:
+        columns.write(options.columnarOutput, options.edgeTable)
     return validatedTrips
 
 
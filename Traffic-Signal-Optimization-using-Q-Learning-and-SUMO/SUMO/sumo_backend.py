@@ -0,0 +1,75 @@
+"""Thin adapter choosing between TraCI and libsumo for the controllers.
+
+libsumo has the same API as traci but runs SUMO inside the Python process, so
+every getter is a function call instead of a round trip over the TraCI socket.
+It cannot show the GUI and supports only one simulation per process. The
+controllers use this module in place of traci:
+
+    import sumo_backend as traci
+
+start() picks libsumo for headless runs (sumo) when it is installed and the
+backend is "auto", and TraCI for sumo-gui. All other attributes (trafficlight,
+lane, simulation, ...) are forwarded to the module of the running simulation.
+The backend can be set with set_backend() or the SUMO_BACKEND environment
+variable ("auto", "traci" or "libsumo").
+"""
+import os
+
+import traci as _traci
+
+try:
+    import libsumo as _libsumo
+except ImportError:
+    _libsumo = None
+
+BACKENDS = ("auto", "traci", "libsumo")
+
+_backend = os.environ.get("SUMO_BACKEND", "auto")
+_module = _traci
+
+
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown SUMO backend '%s', use one of %s." % (name, ", ".join(BACKENDS)))
+    if name == "libsumo" and _libsumo is None:
+        raise ValueError("The libsumo backend is not installed.")
+    _backend = name
+
+
+def libsumo_available():
+    return _libsumo is not None
+
+
+def is_gui(cmd):
+    return os.path.basename(cmd[0]).startswith("sumo-gui")
+
+
+def backend_name():
+    """name of the module used by the running (or last) simulation"""
+    return "libsumo" if _module is _libsumo else "traci"
+
+
+def select(cmd):
+    """return the module which start() uses for the command line"""
+    if _backend == "traci" or _libsumo is None or is_gui(cmd):
+        if _backend == "libsumo" and is_gui(cmd):
+            raise ValueError("The libsumo backend cannot run %s." % cmd[0])
+        return _traci
+    return _libsumo
+
+
+def start(cmd, label=None, **kwargs):
+    """start the simulation with the selected backend. The label (and the
+    other traci.start arguments) only apply to TraCI"""
+    global _module
+    _module = select(cmd)
+    if _module is _libsumo:
+        return _module.start(cmd)
+    if label is not None:
+        kwargs["label"] = label
+    return _module.start(cmd, **kwargs)
+
+
+def __getattr__(name):
+    return getattr(_module, name)